@@ -1,5 +1,5 @@
 from __future__ import unicode_literals
-import codecs
+import collections
 import datetime
 import os
 import re
@@ -7,11 +7,24 @@ import sublime
 import sublime_plugin
 import threading
 import functools
+import hashlib
 import platform
+import random
+import time
 from datetime import date
 
-VERSION = int(sublime.version())
-ST2 = VERSION < 3000
+from Pelican.lib.article_index import ArticleIndex
+from Pelican.lib.blog_meta import MetadataStore
+from Pelican.lib.articles import (
+    DEFAULT_EXCLUDE_GLOBS, ArticleMatcher, filter_articles, find_articles,
+    read_article_metadata)
+from Pelican.lib.jobs import Cancelled, JobManager
+from Pelican.lib.scheduler import BACKGROUND, Scheduler
+from Pelican.lib.slug import SlugEngine
+from Pelican.lib.unidecode import Cache as unidecode_cache
+from Pelican.lib.unidecode import LARGE_SECTIONS
+from Pelican.lib.unidecode import close_table as close_unidecode_table
+from Pelican.lib.watcher import start_watcher
 
 pelican_slug_template = {
     "md": "Slug: %s\n",
@@ -32,33 +45,196 @@ default_filter = '.*\\.(md|markdown|mkd|rst)$'
 
 pelican_article_views = []
 
+article_indexes = {}
+article_watchers = {}
+last_scan_stats = {}
+last_quick_panel_stats = {}
+article_indexes_lock = threading.Lock()
+scan_jobs = JobManager()
+scheduler = Scheduler(name=__name__)
+metadata_store = None
+metadata_store_lock = threading.Lock()
+# cleared by plugin_unloaded() to end the release_idle_unidecode_sections
+# timer chain
+release_timer_active = False
+
+slug_engine = SlugEngine()
+
 
 def slugify(value):
-        """
-        Normalizes string, converts to lowercase, removes non-alpha characters,
-        and converts spaces to hyphens.
+    return slug_engine.slugify(value)
 
-        Took from django sources.
-        """
-        # value must be unicode per se
-        import unicodedata
-        if ST2:
-            from lib.unidecode import unidecode
-        else:
-            from Pelican.lib.unidecode import unidecode
-        value = unicodedata.normalize('NFKD', value).lower()
-        value = unidecode(value, ST2)
-        value = re.sub('[^\w\s-]', '', value).strip()
-        value = re.sub('[-\s]+', '-', value)
-        return value
+
+def configure_unidecode_cache():
+    settings = sublime.load_settings("Pelican.sublime-settings")
+    unidecode_cache.configure(
+        settings.get("unidecode_cache_max_sections", 128),
+        settings.get("unidecode_cache_max_bytes", None))
+
+
+def release_idle_unidecode_sections():
+    if not release_timer_active:
+        return
+    settings = sublime.load_settings("Pelican.sublime-settings")
+    idle_seconds = settings.get("unidecode_cache_idle_seconds", 600)
+    if idle_seconds:
+        unidecode_cache.release_idle(idle_seconds, LARGE_SECTIONS)
+    sublime.set_timeout(release_idle_unidecode_sections, 60 * 1000)
+
+
+def parse_unidecode_sections(sections):
+    """Sections may be given as numbers or hex strings, e.g. 78 or "4e"."""
+    results = set()
+    for section in sections or []:
+        try:
+            if isinstance(section, int):
+                results.add(section)
+            else:
+                results.add(int(section, 16))
+        except ValueError:
+            print("%s: invalid Unicode section %r" % (__name__, section))
+    return results
+
+
+def plugin_loaded():
+    global release_timer_active
+    settings = sublime.load_settings("Pelican.sublime-settings")
+    scheduler.configure(settings.get("worker_threads", 3))
+    configure_unidecode_cache()
+    if not release_timer_active:
+        release_timer_active = True
+        sublime.set_timeout(release_idle_unidecode_sections, 60 * 1000)
+    scheduler.submit(
+        PelicanPrewarmTransliterationJob(sublime.active_window()).run,
+        "prewarm transliteration", BACKGROUND)
+    if settings.get("metadata_prefetch_on_startup", False):
+        scheduler.submit(
+            prefetch_blog_metadata, "prefetch blog metadata", BACKGROUND)
+
+
+def plugin_unloaded():
+    global release_timer_active
+    release_timer_active = False
+    scan_jobs.cancel_all()
+    scheduler.shutdown()
+    stop_article_watchers()
+    close_unidecode_table()
+
+
+class PelicanPrewarmTransliterationJob(object):
+    """Load the transliteration sections used by the blog's titles.
+
+    Sections are otherwise loaded by the first slug that needs them, which
+    may be generated on a keystroke in the title line.
+    """
+
+    def __init__(self, window):
+        self.window = window
+
+    def run(self):
+        settings = sublime.load_settings("Pelican.sublime-settings")
+        pinned = parse_unidecode_sections(
+            settings.get("unidecode_pinned_sections", []))
+        if pinned:
+            unidecode_cache.pin(pinned)
+
+        sample_size = settings.get("unidecode_prewarm_sample_size", 200)
+        if not sample_size or self.window is None:
+            return
+        view = self.window.active_view()
+        if view is None or not view.file_name():
+            return
+        root = search_for_root(self.window)
+        if root == "":
+            return
+
+        sections = set()
+        for title in self.sample_titles(root, view, sample_size):
+            sections.update(slug_engine.sections(title))
+
+        unidecode_cache.preload(sorted(sections))
+
+    def sample_titles(self, root, view, sample_size):
+        # the titles saved by the last session, if any, spare reading the
+        # articles
+        records = get_article_index(root).records()
+        if records:
+            if len(records) > sample_size:
+                records = random.sample(records, sample_size)
+            return [record["title"] for record in records if record["title"]]
+
+        article_paths = list_articles(root, view)[0]
+        if len(article_paths) > sample_size:
+            article_paths = random.sample(article_paths, sample_size)
+        titles = []
+        for article_path in article_paths:
+            try:
+                title = read_article_metadata(article_path)["title"]
+            except (IOError, OSError):
+                continue
+            if title:
+                titles.append(title)
+        return titles
+
+
+class PelicanShowStatsCommand(sublime_plugin.WindowCommand):
+
+    def run(self):
+        messages = [
+            ("Transliteration cache: %(sections)d sections, "
+             "%(bytes_resident)d bytes, %(hits)d hits, %(misses)d misses, "
+             "%(loads)d loads, %(evictions)d evictions"
+             ) % unidecode_cache.stats(),
+            ("Slug cache: %(size)d slugs, %(hits)d hits, "
+             "%(misses)d misses") % slug_engine.stats(),
+        ]
+        if last_scan_stats:
+            messages.append(
+                ("Last article scan (%(backend)s): %(articles)d articles, "
+                 "%(visited)d entries visited, %(skipped)d skipped, "
+                 "%(pruned)d directories pruned") % last_scan_stats)
+        with article_indexes_lock:
+            indexes = sorted(article_indexes.items())
+        for root, index in indexes:
+            messages.append(
+                ("Article index %(root)s: %(articles)d articles, "
+                 "%(unchanged)d unchanged, %(stat_dirty)d stat-dirty, "
+                 "%(changed)d changed, %(removed)d removed"
+                 ) % dict(index.stats, root=root))
+        messages.append(
+            ("Article scans: %(started)d started, %(coalesced)d coalesced, "
+             "%(cancelled)d cancelled") % scan_jobs.stats)
+        if metadata_store is not None:
+            messages.append(
+                ("Blog metadata: %(full)d full downloads, %(not_modified)d "
+                 "not modified, %(failed)d failed, %(bytes)d bytes received, "
+                 "%(disk_loads)d loads from disk, %(memory_hits)d from "
+                 "memory") % dict(metadata_store.stats,
+                          bytes=metadata_store.client.bytes_received))
+        scheduler_stats = scheduler.stats()
+        for name, stats in sorted(scheduler_stats["jobs"].items()):
+            messages.append(
+                ("Job %(name)s: %(runs)d runs, %(failures)d failed, "
+                 "%(wait_ms).0f ms queued and %(run_ms).0f ms running on "
+                 "average, %(run_max_ms).0f ms at most") % dict(
+                    stats, name=name,
+                    wait_ms=stats["wait_total"] * 1000 / stats["runs"],
+                    run_ms=stats["run_total"] * 1000 / stats["runs"],
+                    run_max_ms=stats["run_max"] * 1000))
+        if last_quick_panel_stats:
+            messages.append(
+                ("Last %(mode)s panel: first results from %(source)s after "
+                 "%(first_result_ms).0f ms, complete after "
+                 "%(complete_ms).0f ms") % last_quick_panel_stats)
+        for message in messages:
+            print("%s: %s" % (__name__, message))
+        sublime.status_message(messages[0])
 
 
 class PelicanLinkToPost(sublime_plugin.TextCommand):
     def run(self, edit):
-        articles_paths = get_article_paths(window=self.view.window())
-        thread = PelicanInsertTagCategoryThread(
-            self, articles_paths, "post")
-        thread.start()
+        scheduler.submit(
+            PelicanInsertTagCategoryJob(self, "post").run, "link to post")
 
 
 class PelicanMovePostToContents(sublime_plugin.TextCommand):
@@ -87,19 +263,18 @@ class PelicanMovePostToContents(sublime_plugin.TextCommand):
         # File format: YYYYMMDD-name
         newFile = os.path.join(folder, "%s-%s" % (datePrefix, fileName))
 
-        thread = PelicanMovePostToContentsThread(
-            self.view, fullPath, newFile)
-        thread.start()
+        scheduler.submit(
+            PelicanMovePostToContentsJob(self.view, fullPath, newFile).run,
+            "move post to contents")
 
 
-class PelicanMovePostToContentsThread(threading.Thread):
+class PelicanMovePostToContentsJob(object):
 
     def __init__(self, view, fullPath, newFile):
         self.window = view.window()
         self.view = view
         self.fullPath = fullPath
         self.newFile = newFile
-        threading.Thread.__init__(self)
 
     def run(self):
         if self.view.is_dirty():
@@ -115,6 +290,7 @@ class PelicanMovePostToContentsThread(threading.Thread):
         except OSError as err:
             sublime.status_message("Error: %s" % err.strerror)
         else:
+            rename_in_article_index(self.fullPath, self.newFile)
             self.window.open_file(self.newFile)
             sublime.status_message("Moved to %s" % (self.newFile))
 
@@ -311,9 +487,8 @@ class PelicanInsertMetadataCommand(sublime_plugin.TextCommand):
 class PelicanInsertTagCommand(sublime_plugin.TextCommand):
 
     def run(self, edit):
-        articles_paths = get_article_paths(window=self.view.window())
-        thread = PelicanInsertTagCategoryThread(self, articles_paths, "tag")
-        thread.start()
+        scheduler.submit(
+            PelicanInsertTagCategoryJob(self, "tag").run, "insert tag")
 
 
 class PelicanInsertToViewCommand(sublime_plugin.TextCommand):
@@ -327,10 +502,9 @@ class PelicanInsertToViewCommand(sublime_plugin.TextCommand):
 class PelicanInsertCategoryCommand(sublime_plugin.TextCommand):
 
     def run(self, edit):
-        articles_paths = get_article_paths(window=self.view.window())
-        thread = PelicanInsertTagCategoryThread(
-            self, articles_paths, "category")
-        thread.start()
+        scheduler.submit(
+            PelicanInsertTagCategoryJob(self, "category").run,
+            "insert category")
 
 
 class PelicanReplaceSelectionInViewCommand(sublime_plugin.TextCommand):
@@ -341,14 +515,21 @@ class PelicanReplaceSelectionInViewCommand(sublime_plugin.TextCommand):
             self.view.replace(edit, replace_region, new_string)
 
 
-class PelicanInsertTagCategoryThread(threading.Thread):
+class PelicanInsertTagCategoryJob(object):
 
-    def __init__(self, txtcmd, article_paths, mode):
+    def __init__(self, txtcmd, mode):
         self.window = txtcmd.view.window()
         self.view = txtcmd.view
-        self.article_paths = article_paths
         self.mode = mode
-        threading.Thread.__init__(self)
+        self.started = time.time()
+        self.stats = {"mode": mode}
+        # a newer quick panel request in the window supersedes this one
+        self.ticket = scan_jobs.ticket(("quick_panel", self.window.id()))
+        # quick panel state, only used from the main thread
+        self.results = None
+        self.panel_generation = 0
+        self.panel_closed = False
+        self.highlighted = None
 
     def get_content_region(self):
         meta_type = detect_article_type(self.view)
@@ -428,43 +609,124 @@ class PelicanInsertTagCategoryThread(threading.Thread):
         self.view.run_command(
             'insert', {'characters': "{filename}/%s" % path})
 
+    def run(self):
+        try:
+            self.find_results()
+        except Cancelled:
+            pass
+        finally:
+            scan_jobs.release(self.ticket)
+
+    def find_results(self):
         blog_details = get_blog_details(self.view)
         if "metadata_url" in blog_details and blog_details["metadata_url"] != "":
             blog_name = blog_details["name"]
             metadata_url = blog_details["metadata_url"]
-            self.results = get_categories_tags_from_meta(
+            results = get_categories_tags_from_meta(
                 blog_name,
                 metadata_url,
                 mode=self.mode
             )
         else:
-            self.results = get_categories_tags(
-                self.article_paths,
-                mode=self.mode
+            root = search_for_root(self.window)
+            if root != "" and load_setting(
+                    self.view, "progressive_quick_panel", True):
+                # show what the last session knew while the site is scanned
+                index = get_article_index(root)
+                if not index_is_current(index):
+                    self.show_results(
+                        get_categories_tags(index.records(), self.mode, root),
+                        "last session" if not index.built else "index",
+                        False)
+            results = get_categories_tags(
+                get_article_records(self.window, root, self.ticket),
+                mode=self.mode,
+                root=root
             )
 
+        self.show_results(results, "scan", True)
+
+    def show_results(self, results, source, final):
+        """Show results in the quick panel from the main thread.
+
+        A panel still open is shown again when the final results differ
+        from the ones it lists, keeping the highlighted item.
+        """
         if self.mode == "post":
-            self.results_full = self.results
-            self.results = sorted(list(set(self.results)))
+            # posts come sorted by title
+            results_full = results or {}
+            items = list(results_full)
+        else:
+            results_full = None
+            items = results or []
 
-        def show_quick_panel_meta():
-            if not self.results:
-                sublime.error_message(
-                    ('%s: There is no %s found.') % (__name__, self.mode))
+        def show():
+            if self.ticket.superseded:
                 return
-            self.window.show_quick_panel(self.results, self.on_done)
-
-        def show_quick_panel_post():
-            if not self.results:
-                sublime.error_message(
-                    ('%s: There is no %s found.') % (__name__, self.mode))
+            elapsed_ms = (time.time() - self.started) * 1000
+            if items and "first_result_ms" not in self.stats:
+                self.stats.update(source=source, first_result_ms=elapsed_ms)
+            if final:
+                self.stats["complete_ms"] = elapsed_ms
+                self.stats.setdefault("source", source)
+                self.stats.setdefault("first_result_ms", elapsed_ms)
+                last_quick_panel_stats.clear()
+                last_quick_panel_stats.update(self.stats)
+            if self.panel_closed:
+                return
+            if items == self.results:
+                self.results_full = results_full
+                return
+            if not items:
+                if final:
+                    if self.results:
+                        self.window.run_command("hide_overlay")
+                    sublime.error_message(
+                        ('%s: There is no %s found.') % (__name__, self.mode))
                 return
-            self.window.show_quick_panel(self.results, self.on_done_post)
 
-        if self.mode != "post":
-            sublime.set_timeout(show_quick_panel_meta, 10)
-        else:
-            sublime.set_timeout(show_quick_panel_post, 10)
+            self.results = items
+            self.results_full = results_full
+            self.panel_generation += 1
+            generation = self.panel_generation
+            selected = -1
+            if self.highlighted in items:
+                selected = items.index(self.highlighted)
+
+            def on_done(picked):
+                # a panel replaced by a newer one is closed with -1
+                if generation != self.panel_generation:
+                    return
+                self.panel_closed = True
+                if self.mode == "post":
+                    self.on_done_post(picked)
+                else:
+                    self.on_done(picked)
+
+            def on_highlight(index):
+                if generation == self.panel_generation and index >= 0:
+                    self.highlighted = items[index]
+
+            self.window.show_quick_panel(
+                items, on_done, 0, selected, on_highlight)
+
+        sublime.set_timeout(show, 10)
+
+
+class PelicanArticleIndexListener(sublime_plugin.EventListener):
+    """Keep the article indexes current with the files edited in Sublime."""
+
+    def on_post_save_async(self, view):
+        update_article_index(view.file_name(), view)
+
+    def on_load_async(self, view):
+        update_article_index(view.file_name(), view)
+
+    def on_close(self, view):
+        path = view.file_name()
+        if path:
+            sublime.set_timeout_async(
+                lambda: update_article_index(path), 0)
 
 
 class PelicanArticleClose(sublime_plugin.EventListener):
@@ -667,100 +929,268 @@ def get_input_path(window):
         return ""
 
 
-def get_article_paths(window):
-    article_paths = []
+def get_article_matcher(view=None):
+    if view is None:
+        settings = sublime.load_settings("Pelican.sublime-settings")
+        exclude_globs = settings.get(
+            "article_exclude_globs", DEFAULT_EXCLUDE_GLOBS)
+    else:
+        exclude_globs = load_setting(
+            view, "article_exclude_globs", DEFAULT_EXCLUDE_GLOBS)
+    return ArticleMatcher(exclude_globs=exclude_globs)
+
+
+def get_article_list_settings(view=None):
+    # the find_articles() and filter_articles() arguments from the article
+    # settings of view, or the global ones
+    if view is None:
+        settings = sublime.load_settings("Pelican.sublime-settings")
+        max_file_size = settings.get("article_max_file_size", None)
+        use_git = settings.get("article_list_with_git", False)
+    else:
+        max_file_size = load_setting(view, "article_max_file_size", None)
+        use_git = load_setting(view, "article_list_with_git", False)
+    return {"matcher": get_article_matcher(view),
+            "max_file_size": max_file_size, "use_git": use_git}
+
+
+def list_articles(root, view=None):
+    """Return the paths of the articles under root and scan statistics,
+    applying the article settings of view, or the global ones."""
+    return find_articles(root, **get_article_list_settings(view))
 
+
+def get_article_paths(window):
     # load INPUTDIR
     inputdir = search_for_root(window)
     if inputdir == "":
         return []
 
     # get paths of all articles in INPUTDIR
-    inputdir_structure = os.walk(inputdir)
-    if inputdir_structure:
-        for (dirpath, dirnames, filenames) in inputdir_structure:
-            for filename in filenames:
-                article_path = os.path.join(dirpath, filename)
-                if re.search(default_filter, article_path):
-                    article_paths.append(article_path)
-    else:
-        return []
+    article_paths, stats = list_articles(inputdir, window.active_view())
+    last_scan_stats.clear()
+    last_scan_stats.update(stats)
 
     return article_paths
 
 
+def get_metadata_store():
+    global metadata_store
+    with metadata_store_lock:
+        if metadata_store is None:
+            settings = sublime.load_settings("Pelican.sublime-settings")
+            metadata_store = MetadataStore(
+                os.path.join(sublime.packages_path(), "Pelican"),
+                max_age=settings.get("metadata_max_age", 300),
+                connect_timeout=settings.get("metadata_connect_timeout", 5),
+                read_timeout=settings.get("metadata_read_timeout", 15)
+            )
+        return metadata_store
+
+
+def prefetch_blog_metadata():
+    # fetch the metadata of every blog in all_blogs that has none cached
+    # yet or a stale copy, so that the first command is served from cache
+    settings = sublime.load_settings("Pelican.sublime-settings")
+    window = sublime.active_window()
+    view = window.active_view() if window is not None else None
+    if view is not None:
+        all_blogs = load_setting(view, "all_blogs", None)
+    else:
+        all_blogs = settings.get("all_blogs", None)
+    blogs = {}
+    for name, blog_settings in (all_blogs or {}).items():
+        if blog_settings.get("metadata_url"):
+            blogs[name] = blog_settings["metadata_url"]
+    get_metadata_store().prefetch(
+        blogs, settings.get("metadata_prefetch_workers", 4))
+
+
 def get_categories_tags_from_meta(name, url, mode="tag"):
+    # the cached copy is used right away, and refreshed in the background
+    # when it is stale
+    store = get_metadata_store()
+    metadata, stale = store.get(
+        name, url,
+        lambda refresh: scheduler.submit(
+            refresh, "refresh blog metadata", BACKGROUND)
+    )
+    if stale:
+        error = store.errors.get(name)
+        sublime.status_message(
+            "Pelican: metadata of %s may be outdated%s" % (
+                name, ", %s" % error if error else ", refreshing"))
+    if metadata is None:
+        return None
+
     results = []
-    # Download the metadata
-    import urllib.request
-    import urllib.error
-    import json
+    if 'cats' in metadata and mode == "category":
+        results = metadata['cats']
+    elif 'tags' in metadata and mode == "tag":
+        results = metadata['tags']
+    elif 'posts' in metadata and mode == 'post':
+        results = metadata['posts']
+
+    # tags, categories and posts come sorted, without duplicates
+    if len(results) == 0:
+        return None
 
-    metajson = ""
-    cache_path = os.path.join(sublime.packages_path(), "Pelican")
-    if not os.path.exists(cache_path):
-        os.mkdir(cache_path)
-    cache_file = os.path.join(cache_path, "meta-%s.json" % name)
+    return results
 
-    try:
-        response = urllib.request.urlopen(url)
-        metajson = response.read().decode("utf-8")
-    except urllib.error.URLError as e:
-        pass
 
+def get_index_path(root):
+    cache_path = os.path.join(sublime.cache_path(), "Pelican")
     try:
-        if metajson is "":
-            # Try to load last from file
-            with open(cache_file, 'r') as f:
-                metajson = f.read()
-        else:
-            # Try to save latest to file
-            with open(cache_file, 'w') as f:
-                f.write(metajson)
-    except Exception as e:
-        print(e)
-
-    if metajson is not "":
-        # We got something either from URL or file
-        metadata = json.loads(metajson)
-        if 'cats' in metadata and mode == "category":
-            results = metadata['cats']
-        elif 'tags' in metadata and mode == "tag":
-            results = metadata['tags']
-        elif 'posts' in metadata and mode == 'post':
-            results = metadata['posts']
-
-        if len(results) == 0:
-            return None
-
-        if mode != "post":
-            list_results = sorted(list(set(results)))
-            if '' in list_results:
-                list_results.remove('')
-        else:
-            list_results = results
+        os.makedirs(cache_path)
+    except OSError:
+        if not os.path.isdir(cache_path):
+            raise
+    root_hash = hashlib.sha1(root.encode("utf-8")).hexdigest()
+    return os.path.join(cache_path, "index-%s.sqlite" % root_hash[:16])
+
+
+def get_article_index(root):
+    with article_indexes_lock:
+        if root not in article_indexes:
+            settings = sublime.load_settings("Pelican.sublime-settings")
+            article_indexes[root] = ArticleIndex(
+                root,
+                get_index_path(root),
+                workers=settings.get("article_index_workers", 4)
+            )
+            # the watcher walks the tree from its own thread
+            if settings.get("watch_content_root", False):
+                start_article_watcher(article_indexes[root])
+        return article_indexes[root]
+
+
+def start_article_watcher(index):
+    settings = sublime.load_settings("Pelican.sublime-settings")
+    article_watchers[index.root] = start_watcher(
+        index.root,
+        functools.partial(apply_watched_changes, index),
+        get_article_matcher(),
+        interval=settings.get("watch_poll_interval", 5),
+        list_articles=lambda root: list_articles(root)[0]
+    )
 
-        return list_results
-    else:
-        return None
+
+def stop_article_watchers():
+    with article_indexes_lock:
+        for watcher in article_watchers.values():
+            watcher.stop()
+        article_watchers.clear()
+
+
+def apply_watched_changes(index, paths):
+    # the first refresh() of the index reads everything anyway
+    if not index.built:
+        return
+    if paths is None:
+        scan_jobs.run(("scan", index.root), lambda job: index.refresh(
+            list_articles(index.root)[0], job.check))
+        return
+    changed = []
+    for path in paths:
+        if os.path.isdir(path):
+            # every file is checked against the settings of the blog below
+            changed.extend(find_articles(
+                path, ArticleMatcher(exclude_globs=()))[0])
+            continue
+        # a removed directory takes its articles with it
+        prefix = os.path.join(path, "")
+        for record in index.records():
+            if record["path"].startswith(prefix):
+                changed.append(record["path"])
+        changed.append(path)
+    listed = set(filter_articles(
+        index.root, changed, **get_article_list_settings()))
+    for path in changed:
+        index.update_path(path, path in listed)
+
+
+def index_is_current(index):
+    """Whether the index is kept up to date without a rescan: once built,
+    a watched blog gets changes made outside Sublime Text from its watcher
+    and the others only get the ones saved from Sublime Text."""
+    return index.built and index.root in article_watchers
+
+
+def get_article_records(window, root, ticket=None):
+    # a watched blog is only walked once per session, later changes come in
+    # through the watcher and update_article_index(); other blogs are
+    # rescanned on every command, which only stats unchanged articles
+    if root == "":
+        return []
+    index = get_article_index(root)
+    if not index_is_current(index):
+        # concurrent requests for the same blog share a single scan
+        scan_jobs.run(("scan", root),
+                      functools.partial(scan_articles, window, index), ticket)
+    return index.records()
+
+
+def scan_articles(window, index, job):
+    article_paths = get_article_paths(window)
+    index.refresh(article_paths, job.check)
 
 
-def get_categories_tags(articles_paths, mode="tag"):
-    # retrieve categories or tags
+def update_article_index(path, view=None):
+    """Update the record of path in the index of every blog containing it."""
+    if not path:
+        return
+    with article_indexes_lock:
+        indexes = list(article_indexes.values())
+    for index in indexes:
+        if is_in_blog(index, path):
+            index.update_path(path, is_indexed_article(index, path, view))
+
+
+def rename_in_article_index(old_path, new_path, view=None):
+    """Move the record of a renamed file in the indexes of the blogs
+    containing it, which may differ before and after the move."""
+    with article_indexes_lock:
+        indexes = list(article_indexes.values())
+    for index in indexes:
+        was_inside = is_in_blog(index, old_path)
+        if is_in_blog(index, new_path):
+            is_article = is_indexed_article(index, new_path, view)
+            if was_inside:
+                index.rename(old_path, new_path, is_article)
+            else:
+                index.update_path(new_path, is_article)
+        elif was_inside:
+            index.update_path(old_path, False)
+
+
+def is_in_blog(index, path):
+    return path.startswith(os.path.join(index.root, ""))
+
+
+def is_indexed_article(index, path, view=None):
+    # whether a scan of the blog of index would list path
+    return bool(filter_articles(
+        index.root, [path], **get_article_list_settings(view)))
+
+
+def get_categories_tags(article_records, mode="tag", root=""):
+    # retrieve categories, tags or posts ({title: path relative to root},
+    # sorted by title)
+    if mode == "post":
+        posts = {}
+        for record in article_records:
+            if record["title"]:
+                posts[record["title"]] = os.path.relpath(
+                    record["path"], root).replace(os.sep, "/")
+        return collections.OrderedDict(sorted(posts.items())) or None
+
     results = []
-    for article_path in articles_paths:
+    for record in article_records:
         if mode == "category":
-            regex = re.compile("category:(.*)", re.IGNORECASE)
+            if record["category"]:
+                results.append(record["category"])
         else:
-            regex = re.compile("tags:(.*)", re.IGNORECASE)
-
-        with codecs.open(article_path, 'r', 'utf-8') as f:
-            content_str = f.read()
-
-        regex_results = regex.findall(content_str)
-        if len(regex_results) > 0:
-            for result in regex_results:
-                results.extend([x.strip() for x in result.split(",")])
+            results.extend(record["tags"])
 
     if len(results) == 0:
         return None
@@ -0,0 +1,282 @@
+"""Measure fetching blog metadata from a local stand-in HTTP server.
+
+Serves a synthetic meta.json of --posts posts from http.server on
+localhost, uncompressed or gzip compressed, optionally throttled to
+--bandwidth KiB/s. Fetches it --repeat times with MetadataStore, and
+reports the full and conditional (304 Not Modified) responses the server
+sent, the bytes it sent, and the time from the start of a fetch until
+the sorted tags for the quick panel are ready.
+
+Then serves --blogs blogs from each of --hosts servers, answering after
+--latency ms, and compares refreshing the blogs one after the other with
+MetadataStore.prefetch(), reporting the time and the connections opened.
+Runs on plain CPython, without Sublime Text:
+
+    python bench/bench_blog_meta.py
+    python bench/bench_blog_meta.py --posts 20000 --bandwidth 1024
+    python bench/bench_blog_meta.py --hosts 4 --blogs 5 --latency 100
+    python bench/bench_blog_meta.py --check
+
+--check exits non-zero unless revalidating an unchanged meta.json gets a
+304 Not Modified and leaves the cached copy as it was, and a changed one
+is downloaded again, for either validator and encoding.
+"""
+import argparse
+import email.utils
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from lib.blog_meta import MetadataStore  # noqa: E402
+
+
+def make_metadata(count):
+    tags = ["tag%d" % n for n in range(count // 10 + 1)]
+    return {
+        "cats": ["category%d" % n for n in range(20)],
+        "tags": tags,
+        "posts": dict(("Post number %d about %s" % (n, tags[n % len(tags)]),
+                       "posts/%d/post-%d.md" % (2000 + n % 20, n))
+                      for n in range(count)),
+    }
+
+
+class MetadataServer(HTTPServer):
+    """Serves one payload, honoring If-None-Match and If-Modified-Since,
+    and counts what it sent.
+
+    validators names the ones sent, "etag" and "last-modified", and
+    set_payload() changes both. When compress is set, the payload is sent
+    gzip compressed to clients accepting it. bandwidth limits the bytes
+    sent per second, latency delays every response by that many seconds.
+    """
+
+    def __init__(self, payload, bandwidth=None, latency=0):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), MetadataHandler)
+        self.compress = False
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.validators = ("etag", "last-modified")
+        self.modified = time.time()
+        self.counts = {"full": 0, "not_modified": 0, "bytes": 0,
+                       "connections": 0}
+        self.set_payload(payload)
+
+    def set_payload(self, payload):
+        self.payload = payload
+        self.gzipped = gzip.compress(payload)
+        self.etag = '"%s"' % hashlib.sha1(payload).hexdigest()
+        # Last-Modified has a resolution of one second
+        self.modified = max(time.time(), self.modified + 1)
+        self.last_modified = email.utils.formatdate(self.modified,
+                                                    usegmt=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/meta.json" % self.server_port
+
+
+class MetadataHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"  # keep connections open
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.counts["connections"] += 1
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        # If-None-Match takes precedence over If-Modified-Since
+        if "etag" in server.validators and "If-None-Match" in self.headers:
+            not_modified = self.headers["If-None-Match"] == server.etag
+        else:
+            not_modified = "last-modified" in server.validators and \
+                self.headers.get("If-Modified-Since") == server.last_modified
+        if not_modified:
+            server.counts["not_modified"] += 1
+            self.send_response(304)
+            self.send_header("ETag", server.etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = server.payload
+        self.send_response(200)
+        if server.compress and \
+                "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = server.gzipped
+            self.send_header("Content-Encoding", "gzip")
+        server.counts["full"] += 1
+        server.counts["bytes"] += len(body)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if "etag" in server.validators:
+            self.send_header("ETag", server.etag)
+        if "last-modified" in server.validators:
+            self.send_header("Last-Modified", server.last_modified)
+        self.end_headers()
+        if not server.bandwidth:
+            self.wfile.write(body)
+            return
+        step = 16 * 1024
+        for start in range(0, len(body), step):
+            self.wfile.write(body[start:start + step])
+            time.sleep(float(step) / server.bandwidth)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(server, repeat, compress, conditional):
+    cache_dir = tempfile.mkdtemp(prefix="pelican-bench-")
+    try:
+        store = MetadataStore(cache_dir)
+        server.compress = compress
+        server.counts.update(full=0, not_modified=0, bytes=0)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            store.fetch("bench", server.url, conditional=conditional)
+        elapsed = time.perf_counter() - start
+        cache_size = os.path.getsize(store.cache_path("bench"))
+    finally:
+        shutil.rmtree(cache_dir)
+    print("%-9s %-12s %6d %6d %12d %12d %10.1f" % (
+        "gzip" if compress else "identity",
+        "conditional" if conditional else "full", server.counts["full"],
+        server.counts["not_modified"], server.counts["bytes"], cache_size,
+        elapsed / repeat * 1e3))
+
+
+def check_revalidation(server, compress, validators):
+    """Return the failures of fetching, revalidating, changing and
+    fetching again the metadata served by server."""
+    failures = []
+    cache_dir = tempfile.mkdtemp(prefix="pelican-bench-")
+    try:
+        store = MetadataStore(cache_dir)
+        server.compress = compress
+        server.validators = validators
+        server.counts.update(full=0, not_modified=0)
+        first = store.fetch("check", server.url)
+        path = store.cache_path("check")
+        with open(path, "rb") as f:
+            cached = (os.fstat(f.fileno()).st_ino, f.read())
+        second = store.fetch("check", server.url)
+        with open(path, "rb") as f:
+            if (os.fstat(f.fileno()).st_ino, f.read()) != cached:
+                failures.append("cached copy rewritten on 304")
+        if (server.counts["full"], server.counts["not_modified"]) != (1, 1):
+            failures.append("%(full)d full, %(not_modified)d not modified "
+                            "responses, expected 1 and 1" % server.counts)
+        if second != first:
+            failures.append("revalidated metadata differs")
+        payload = server.payload
+        changed = dict(json.loads(payload.decode("utf-8")), tags=["new"])
+        server.set_payload(json.dumps(changed).encode("utf-8"))
+        try:
+            if store.fetch("check", server.url)["tags"] != ["new"]:
+                failures.append("changed metadata not downloaded")
+        finally:
+            server.set_payload(payload)
+    finally:
+        shutil.rmtree(cache_dir)
+    return failures
+
+
+def check(payload):
+    server = start_server(MetadataServer(payload))
+    failed = False
+    for compress in (False, True):
+        for validators in (("etag",), ("last-modified",),
+                           ("etag", "last-modified")):
+            failures = check_revalidation(server, compress, validators)
+            failed = failed or bool(failures)
+            print("%-9s %-22s %s" % (
+                "gzip" if compress else "identity", " + ".join(validators),
+                "; ".join(failures) or "ok"))
+    server.shutdown()
+    return not failed
+
+
+def start_server(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def run_prefetch(payload, hosts, blogs_per_host, latency):
+    servers = [start_server(MetadataServer(payload, latency=latency))
+               for _ in range(hosts)]
+    blogs = {}
+    for n, server in enumerate(servers):
+        for m in range(blogs_per_host):
+            blogs["blog%d-%d" % (n, m)] = server.url.replace(
+                "meta.json", "blog%d/meta.json" % m)
+    print("%-12s %10s %12s" % ("", "ms", "connections"))
+    for prefetch in (False, True):
+        cache_dir = tempfile.mkdtemp(prefix="pelican-bench-")
+        try:
+            store = MetadataStore(cache_dir)
+            for server in servers:
+                server.counts["connections"] = 0
+            start = time.perf_counter()
+            if prefetch:
+                store.prefetch(blogs, workers=hosts)
+            else:
+                for name, url in sorted(blogs.items()):
+                    store.refresh(name, url)
+            elapsed = time.perf_counter() - start
+            assert all(store.load(name)[0] for name in blogs)
+        finally:
+            shutil.rmtree(cache_dir)
+        print("%-12s %10.1f %12d" % (
+            "prefetch" if prefetch else "one by one", elapsed * 1e3,
+            sum(server.counts["connections"] for server in servers)))
+    for server in servers:
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--bandwidth", type=int, default=0,
+                        help="KiB/s sent by the server, 0 for no limit")
+    parser.add_argument("--hosts", type=int, default=3)
+    parser.add_argument("--blogs", type=int, default=4,
+                        help="blogs per host for the prefetch comparison")
+    parser.add_argument("--latency", type=int, default=50,
+                        help="ms before each prefetch response")
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    payload = json.dumps(make_metadata(args.posts)).encode("utf-8")
+    if args.check:
+        sys.exit(0 if check(payload) else 1)
+    server = start_server(MetadataServer(payload, args.bandwidth * 1024))
+    print("meta.json: %d posts, %d bytes, %d gzip compressed" % (
+        args.posts, len(payload), len(server.gzipped)))
+    print("%-9s %-12s %6s %6s %12s %12s %10s" % (
+        "encoding", "requests", "200", "304", "bytes sent", "cache bytes",
+        "ms/panel"))
+    for compress in (False, True):
+        for conditional in (False, True):
+            run(server, args.repeat, compress, conditional)
+    server.shutdown()
+    print()
+    run_prefetch(payload, args.hosts, args.blogs, args.latency / 1000.0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Compare listing the articles of a blog with git and by walking it.
+
+Creates a git repository of --files files (articles, theme and static
+files, plus ignored build output) in a temporary directory, or uses an
+existing work tree given with --root, and times a plain os.walk(), the
+directory walk of find_articles() and its git backend. Runs on plain
+CPython, without Sublime Text:
+
+    python bench/bench_enumerate.py
+    python bench/bench_enumerate.py --root ~/blog
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from lib.articles import ArticleMatcher, find_articles  # noqa: E402
+
+# share of the files in each directory, and their extension
+LAYOUT = (
+    ("content/posts/%03d", 0.4, "md"),
+    ("content/pages/%03d", 0.05, "rst"),
+    ("content/images/%03d", 0.15, "png"),
+    ("theme/static/%03d", 0.1, "css"),
+    ("plugins/%03d", 0.1, "py"),
+    ("cache/%03d", 0.2, "html"),  # ignored by .gitignore
+)
+FILES_PER_DIRECTORY = 200
+
+
+def make_repository(root, count):
+    for pattern, share, extension in LAYOUT:
+        for n in range(int(count * share)):
+            directory = os.path.join(
+                root, *(pattern % (n // FILES_PER_DIRECTORY)).split("/"))
+            if n % FILES_PER_DIRECTORY == 0:
+                os.makedirs(directory)
+            with open(os.path.join(directory, "file-%d.%s" % (n, extension)),
+                      "w") as f:
+                f.write("Title: File %d\n\n" % n)
+    with open(os.path.join(root, ".gitignore"), "w") as f:
+        f.write("cache/\n")
+
+    def git(*args):
+        subprocess.check_call(
+            ("git", "-c", "user.name=bench", "-c", "user.email=bench@example",
+             "-c", "gc.auto=0") + args, cwd=root, stdout=subprocess.DEVNULL)
+    git("init", "-q")
+    git("add", "-A")
+    git("commit", "-q", "-m", "Benchmark site")
+
+
+def plain_walk(root, matcher):
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if matcher.article_pattern.match(filename):
+                paths.append(os.path.join(dirpath, filename))
+    return paths
+
+
+def best_of(repeat, function):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", help="existing git work tree to list")
+    parser.add_argument("--files", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    root = args.root
+    if root is None:
+        root = tempfile.mkdtemp(prefix="pelican-bench-")
+        print("Creating a repository of %d files in %s" % (args.files, root))
+        make_repository(root, args.files)
+    try:
+        matcher = ArticleMatcher()
+        # os.walk() does not prune anything, so it lists ignored articles
+        # and articles in excluded directories too
+        print("%-22s %10s %10s" % ("", "ms", "articles"))
+        elapsed, paths = best_of(
+            args.repeat, lambda: plain_walk(root, matcher))
+        print("%-22s %10.1f %10d" % ("os.walk", elapsed * 1e3, len(paths)))
+        for use_git in (False, True):
+            elapsed, (paths, stats) = best_of(
+                args.repeat, lambda: find_articles(root, matcher,
+                                                   use_git=use_git))
+            print("%-22s %10.1f %10d" % (
+                "find_articles (%s)" % stats["backend"], elapsed * 1e3,
+                len(paths)))
+    finally:
+        if args.root is None:
+            # ignore_errors: a git process may still be writing below it
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
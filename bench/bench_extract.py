@@ -0,0 +1,100 @@
+"""Compare metadata extraction with different numbers of worker threads.
+
+Writes a synthetic site of Markdown and reStructuredText articles to a
+temporary directory (or --root) and times a full build of the article
+index at each worker count. Runs on plain CPython, without Sublime Text:
+
+    python bench/bench_extract.py
+    python bench/bench_extract.py --root /mnt/nfs/bench --articles 20000
+
+The page cache makes the local disk look fast; point --root at a network
+or encrypted file system to see what the worker threads are for.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from lib.article_index import ArticleIndex  # noqa: E402
+from lib.articles import find_articles  # noqa: E402
+
+MARKDOWN = """Title: Article %(n)d
+Slug: article-%(n)d
+Date: 2016-01-%(day)02d 10:00
+Tags: %(tags)s
+Category: %(category)s
+Author: Someone
+Summary: A synthetic article used to benchmark metadata extraction.
+
+%(body)s
+"""
+
+RST = """Article %(n)d
+##########%(underline)s
+
+:slug: article-%(n)d
+:date: 2016-01-%(day)02d 10:00
+:tags: %(tags)s
+:category: %(category)s
+:author: Someone
+
+%(body)s
+"""
+
+
+def make_site(root, count, seed=1):
+    rng = random.Random(seed)
+    body = "Lorem ipsum dolor sit amet, consectetur adipiscing elit.\n" * 40
+    for n in range(count):
+        directory = os.path.join(root, "content", "%03d" % (n // 500))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        values = {
+            "n": n,
+            "day": n % 28 + 1,
+            "underline": "#" * len(str(n)),
+            "tags": ", ".join("tag%d" % rng.randint(0, 300)
+                              for _ in range(rng.randint(1, 5))),
+            "category": "category%d" % rng.randint(0, 20),
+            "body": body,
+        }
+        if n % 4:
+            name, template = "article-%d.md" % n, MARKDOWN
+        else:
+            name, template = "article-%d.rst" % n, RST
+        with open(os.path.join(directory, name), "w") as f:
+            f.write(template % values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root")
+    parser.add_argument("--articles", type=int, default=20000)
+    parser.add_argument("--workers", default="1,4,16")
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix="pelican-bench-")
+    try:
+        if not os.path.isdir(os.path.join(root, "content")):
+            make_site(root, args.articles)
+        paths = find_articles(os.path.join(root, "content"))[0]
+        print("%d articles in %s" % (len(paths), root))
+        for workers in [int(w) for w in args.workers.split(",")]:
+            index = ArticleIndex(root, workers=workers)
+            start = time.time()
+            records = index.refresh(paths)
+            elapsed = time.time() - start
+            assert len(records) == len(paths)
+            print("%3d workers: %6.2f s" % (workers, elapsed))
+    finally:
+        if not args.root:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
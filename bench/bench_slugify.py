@@ -0,0 +1,142 @@
+"""Slug generation benchmark and equivalence check.
+
+Generates reproducible title corpora in several scripts and reports
+throughput and latency percentiles of slug generation, without and with
+the SlugEngine memo. Runs on plain CPython, without Sublime Text:
+
+    python bench/bench_slugify.py                 # benchmark
+    python bench/bench_slugify.py --check         # compare with golden file
+    python bench/bench_slugify.py --update-golden # rewrite golden file
+
+slugify_golden.json holds the titles of every corpus together with their
+slug and unidecode() output. --check exits non-zero when any engine or
+section representation returns something else, so a faster implementation
+can be proven to give byte-for-byte the same results.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import lib.unidecode as unidecode  # noqa: E402
+from lib.slug import SlugEngine  # noqa: E402
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "slugify_golden.json")
+
+ASCII_LETTERS = [(0x61, 0x7a)]
+SCRIPTS = {
+    "latin": ASCII_LETTERS + [(0xc0, 0xff), (0x100, 0x17f)],
+    "cyrillic": [(0x410, 0x44f)],
+    "greek": [(0x391, 0x3a9), (0x3ac, 0x3ce)],
+    "cjk": [(0x4e00, 0x9fff)],
+    "hangul": [(0xac00, 0xd7a3)],
+    "emoji": ASCII_LETTERS + [(0x1f300, 0x1f64f)],
+}
+SCRIPTS["mixed"] = [r for ranges in list(SCRIPTS.values()) for r in ranges]
+
+PUNCTUATION = " .,:;!?-_'\"()&/"
+
+
+def make_title(rng, ranges):
+    words = []
+    for _ in range(rng.randint(2, 10)):
+        low, high = rng.choice(ranges)
+        words.append("".join(
+            chr(rng.randint(low, high)) for _ in range(rng.randint(1, 8))))
+        if rng.random() < 0.2:
+            words.append(rng.choice(PUNCTUATION))
+    return " ".join(words)
+
+
+def make_corpora(size, seed=1):
+    rng = random.Random(seed)
+    return dict(
+        (name, [make_title(rng, SCRIPTS[name]) for _ in range(size)])
+        for name in sorted(SCRIPTS))
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def bench(corpora, repeat):
+    print("%-9s %-7s %11s %9s %9s %9s" % (
+        "corpus", "memo", "titles/s", "p50 us", "p90 us", "p99 us"))
+    for name, titles in sorted(corpora.items()):
+        for memo in (False, True):
+            engine = SlugEngine()
+            slugify = engine.slugify if memo else engine.slugify_uncached
+            latencies = []
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for title in titles:
+                    t0 = time.perf_counter()
+                    slugify(title)
+                    latencies.append(time.perf_counter() - t0)
+            elapsed = time.perf_counter() - start
+            latencies.sort()
+            print("%-9s %-7s %11.0f %9.1f %9.1f %9.1f" % (
+                name, "on" if memo else "off", len(latencies) / elapsed,
+                percentile(latencies, 0.5) * 1e6,
+                percentile(latencies, 0.9) * 1e6,
+                percentile(latencies, 0.99) * 1e6))
+
+
+def golden_entries(corpora):
+    engine = SlugEngine(maxsize=0)
+    return dict(
+        (name, [[title, engine.slugify(title),
+                 unidecode.unidecode(title)] for title in titles])
+        for name, titles in corpora.items())
+
+
+def check():
+    with io.open(GOLDEN_PATH, encoding="utf-8") as f:
+        golden = json.load(f)
+    failures = 0
+    for representation in ("mapped", "tuple", "compact"):
+        for engine_name in ("translate", "loop"):
+            unidecode.REPRESENTATION = representation
+            unidecode.ENGINE = engine_name
+            unidecode.Cache.clear()
+            engine = SlugEngine(maxsize=0)
+            for name, entries in sorted(golden.items()):
+                for title, slug, ascii_title in entries:
+                    if engine.slugify(title) != slug or \
+                            unidecode.unidecode(title) != ascii_title:
+                        failures += 1
+                        print("MISMATCH %s/%s %s: %r" % (
+                            representation, engine_name, name, title))
+    count = sum(len(entries) for entries in golden.values())
+    print("%d titles, %d mismatches" % (count, failures))
+    return failures == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--update-golden", action="store_true")
+    parser.add_argument("--size", type=int, default=500,
+                        help="titles per corpus for the benchmark")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(0 if check() else 1)
+    if args.update_golden:
+        with io.open(GOLDEN_PATH, "w", encoding="utf-8") as f:
+            json.dump(golden_entries(make_corpora(200)), f,
+                      ensure_ascii=False, indent=0, sort_keys=True)
+            f.write("\n")
+        return
+    bench(make_corpora(args.size), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Compare the unidecode engines on long titles.
+
+"baseline" is the per-character loop unidecode shipped with before the
+section cache and table.bin, reading the x???.py modules into a plain
+dict; speedup is translate against it.
+
+Runs on plain CPython, without Sublime Text:
+
+    python bench/bench_unidecode.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from lib.unidecode import unidecode  # noqa: E402
+
+TITLES = {
+    "ascii": "A perfectly ordinary English title about Pelican " * 4,
+    "latin-1": "Ça déjà été très érudit, naïve façade à l'hôtel " * 4,
+    "cyrillic": "Съешь же ещё этих мягких французских булок " * 4,
+    "cjk": "北京欢迎你，静态网站生成器的中文文章标题示例" * 8,
+}
+
+_baseline_cache = {}
+
+
+def baseline_unidecode(string):
+    retval = []
+    for char in string:
+        codepoint = ord(char)
+        if codepoint < 0x80:
+            retval.append(str(char))
+            continue
+        if codepoint > 0xeffff:
+            continue
+        section = codepoint >> 8
+        position = codepoint % 256
+        try:
+            table = _baseline_cache[section]
+        except KeyError:
+            try:
+                mod = __import__('lib.unidecode.x%03x' % section,
+                                 globals(), locals(), ['data'])
+            except ImportError:
+                _baseline_cache[section] = None
+                continue
+            _baseline_cache[section] = table = mod.data
+        if table and len(table) > position:
+            retval.append(table[position])
+    return ''.join(retval)
+
+
+ENGINES = (
+    ("baseline", baseline_unidecode),
+    ("loop", lambda title: unidecode(title, "loop")),
+    ("translate", lambda title: unidecode(title, "translate")),
+)
+
+
+def main(number=2000):
+    print("%-10s %14s %12s %12s %8s" % (
+        "title", "baseline (us)", "loop", "translate", "speedup"))
+    for name, title in sorted(TITLES.items()):
+        expected = baseline_unidecode(title)
+        timings = []
+        for engine, function in ENGINES:
+            assert function(title) == expected, engine
+            seconds = min(timeit.repeat(
+                lambda: function(title), number=number, repeat=3))
+            timings.append(seconds / number * 1e6)
+        print("%-10s %14.2f %12.2f %12.2f %7.1fx" % (
+            name, timings[0], timings[1], timings[2],
+            timings[0] / timings[2]))
+
+
+if __name__ == '__main__':
+    main()
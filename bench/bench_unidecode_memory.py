@@ -0,0 +1,43 @@
+"""Compare the memory used by the unidecode section representations.
+
+Loads every section in each representation and reports the bytes
+allocated according to tracemalloc.
+
+Runs on plain CPython, without Sublime Text:
+
+    python bench/bench_unidecode_memory.py
+"""
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import lib.unidecode as unidecode  # noqa: E402
+
+SECTIONS = range(0x1d8)
+
+
+def measure(representation):
+    unidecode.REPRESENTATION = representation
+    cache = unidecode.SectionCache(max_sections=None)
+    gc.collect()
+    tracemalloc.start()
+    for section in SECTIONS:
+        cache.get_table(section)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+def main():
+    print("%-10s %14s" % ("", "tables (KiB)"))
+    for representation in ("tuple", "compact", "mapped"):
+        print("%-10s %14.0f" % (
+            representation, measure(representation) / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
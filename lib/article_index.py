@@ -0,0 +1,378 @@
+"""Persistent index of the articles of a blog."""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import sqlite3
+except ImportError:
+    # Some Python builds, e.g. the one embedded in Sublime Text 3, come
+    # without sqlite3; the index is then saved to a JSON file instead.
+    sqlite3 = None
+
+from .articles import (LIST_FIELDS, METADATA_FIELDS, is_rst,
+                       parse_article_header, read_article_header)
+
+# Bump whenever the columns or the way metadata is extracted change; older
+# databases are rebuilt.
+SCHEMA_VERSION = 4
+
+COLUMNS = ("path", "mtime", "size", "header_hash") + METADATA_FIELDS
+
+# Number of articles read by a worker thread at a time.
+READ_CHUNK_SIZE = 64
+
+
+class ArticleIndex(object):
+    """Metadata of the articles under a blog root, keyed on path.
+
+    refresh() revalidates the known articles with stat() only and reads an
+    article again only when its mtime or size changed, so the cost of a
+    refresh grows with the number of changed files rather than the size
+    of the site. Records are stored in the SQLite database at db_path, and
+    are reused across sessions. Without sqlite3 they are stored in a JSON
+    file next to db_path instead, which is rewritten as a whole on every
+    change.
+
+    A header hash is kept for every article as well. When the mtime or
+    size of an article changed but its metadata header did not, as happens
+    to most files after a git checkout, the header is read and hashed but
+    not parsed, and the record only gets the new mtime and size. stats
+    counts these "stat_dirty" articles apart from the "changed" ones.
+
+    Changed articles are read by up to workers threads, which pays off
+    when reading is I/O bound (network or encrypted file systems).
+
+    Updates work on a copy of the records and swap it in when done, so
+    records() never waits for a refresh() in progress.
+    """
+
+    def __init__(self, root, db_path=None, workers=1):
+        self.root = root
+        self.db_path = db_path
+        if db_path is not None and sqlite3 is None:
+            self.db_path = os.path.splitext(db_path)[0] + ".json"
+        self.workers = workers
+        self._records = None
+        self._lock = threading.Lock()  # serializes updates
+        self._load_lock = threading.Lock()
+        self.built = False
+        self.stats = {"articles": 0, "unchanged": 0, "stat_dirty": 0,
+                      "changed": 0, "removed": 0}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            conn.execute("DROP TABLE IF EXISTS articles")
+            conn.execute("CREATE TABLE articles (%s, PRIMARY KEY (path))"
+                         % ", ".join(COLUMNS))
+            conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+            conn.commit()
+        return conn
+
+    def _load(self):
+        records = {}
+        if self.db_path is None:
+            return records
+        if sqlite3 is None:
+            return self._load_json()
+        try:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    "SELECT %s FROM articles" % ", ".join(COLUMNS))
+                for row in rows:
+                    record = dict(zip(COLUMNS, row))
+                    for field in LIST_FIELDS:
+                        record[field] = json.loads(record[field] or "[]")
+                    records[record["path"]] = record
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print("Article index %s: %s" % (self.db_path, e))
+            self.db_path = None
+        return records
+
+    def _save(self, changed, removed):
+        if self.db_path is None or not (changed or removed):
+            return
+        if sqlite3 is None:
+            self._save_json()
+            return
+        # SQLite only takes valid UTF-8; paths holding undecodable bytes
+        # (surrogate escapes) stay in memory only and are read again by
+        # the next session
+        rows = []
+        for record in changed:
+            if not _storable(record["path"]):
+                continue
+            row = []
+            for column in COLUMNS:
+                value = record[column]
+                if column in LIST_FIELDS:
+                    value = json.dumps(value)
+                row.append(value)
+            rows.append(row)
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO articles VALUES (%s)"
+                        % ", ".join("?" * len(COLUMNS)), rows)
+                    conn.executemany(
+                        "DELETE FROM articles WHERE path = ?",
+                        [(path,) for path in removed if _storable(path)])
+            finally:
+                conn.close()
+        except (sqlite3.Error, UnicodeError) as e:
+            print("Article index %s: %s" % (self.db_path, e))
+            self.db_path = None
+
+    def _load_json(self):
+        try:
+            with open(self.db_path, "rb") as f:
+                data = json.loads(f.read().decode("utf-8"))
+        except (IOError, OSError):
+            return {}  # no index saved yet
+        except ValueError as e:
+            print("Article index %s: %s" % (self.db_path, e))
+            return {}
+        if not isinstance(data, dict) or \
+                data.get("version") != SCHEMA_VERSION:
+            return {}
+        return dict((record["path"], record) for record in data["records"])
+
+    def _save_json(self):
+        data = json.dumps({
+            "version": SCHEMA_VERSION,
+            "records": [self._records[path] for path in sorted(self._records)],
+        }).encode("utf-8")
+        directory = os.path.dirname(self.db_path)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.db_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except (IOError, OSError) as e:
+            print("Article index %s: %s" % (self.db_path, e))
+            self.db_path = None
+
+    def _read(self, articles, check=None):
+        """Return the results of _read_article() for (path, known hash)
+        pairs, in order, calling check() between chunks."""
+        # articles are handed out in chunks to keep the per-task overhead
+        # small next to the cost of reading a header
+        chunks = [articles[i:i + READ_CHUNK_SIZE]
+                  for i in range(0, len(articles), READ_CHUNK_SIZE)]
+        def read_chunk(chunk):
+            if check is not None:
+                check()
+            return _read_articles(chunk)
+
+        results = []
+        workers = min(self.workers, len(chunks))
+        if workers <= 1:
+            for chunk in chunks:
+                results.extend(read_chunk(chunk))
+            return results
+        with ThreadPoolExecutor(workers) as executor:
+            futures = [executor.submit(read_chunk, chunk) for chunk in chunks]
+            try:
+                for future in futures:
+                    results.extend(future.result())
+            except BaseException:
+                # do not wait for the chunks nobody will use
+                for future in futures:
+                    future.cancel()
+                raise
+        return results
+
+    def _loaded(self):
+        # the current records, loading the saved ones on first use
+        records = self._records
+        if records is None:
+            with self._load_lock:
+                if self._records is None:
+                    self._records = self._load()
+                records = self._records
+        return records
+
+    def _update_record(self, records, path, st, result):
+        """Store the record of path from a _read_article() result in
+        records and return it, or None when the file could not be read."""
+        if result is None:
+            return None
+        digest, metadata = result
+        if metadata is None:
+            record = dict(records[path])  # same header
+        else:
+            record = dict(metadata, path=path, header_hash=digest)
+        record["mtime"] = st.st_mtime
+        record["size"] = st.st_size
+        records[path] = record
+        return record
+
+    def refresh(self, article_paths, check=None):
+        """Bring the index up to date with article_paths.
+
+        Returns the records of the given articles, in the same order.
+        Articles that are no longer listed are dropped from the index.
+
+        check, if given, is called between chunks of work and may raise to
+        abandon the refresh, leaving the index as it was.
+        """
+        with self._lock:
+            records = dict(self._loaded())
+
+            outdated = []
+            unchanged = 0
+            listed = set()
+            for n, path in enumerate(article_paths):
+                if check is not None and n % READ_CHUNK_SIZE == 0:
+                    check()
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # gone since it was listed
+                listed.add(path)
+                record = records.get(path)
+                if record is not None and record["mtime"] == st.st_mtime \
+                        and record["size"] == st.st_size:
+                    unchanged += 1
+                    continue
+                outdated.append((path, st))
+
+            updated = []
+            changed = 0
+            articles = [(path, records[path]["header_hash"]
+                         if path in records else None)
+                        for path, st in outdated]
+            results = self._read(articles, check)
+            for (path, st), result in zip(outdated, results):
+                record = self._update_record(records, path, st, result)
+                if record is None:
+                    continue
+                updated.append(record)
+                if result[1] is not None:
+                    changed += 1
+
+            removed = [path for path in records if path not in listed]
+            for path in removed:
+                del records[path]
+
+            self._records = records
+            self._save(updated, removed)
+            self.built = True
+            self.stats = {"articles": len(records), "unchanged": unchanged,
+                          "stat_dirty": len(updated) - changed,
+                          "changed": changed, "removed": len(removed)}
+            return [records[path] for path in article_paths
+                    if path in records]
+
+    def records(self):
+        """Return the records of all indexed articles, sorted by path.
+
+        Before the first refresh() is done, these are the records saved by
+        the last session, which may be outdated.
+        """
+        records = self._loaded()
+        return [records[path] for path in sorted(records)]
+
+    def update_path(self, path, is_article=True):
+        """Bring the record of a single file up to date.
+
+        The file is dropped from the index when it no longer exists or is
+        not an article. Does nothing before the first refresh(), which
+        will pick the file up anyway.
+        """
+        with self._lock:
+            if self._records is not None:
+                self._update_path(path, is_article)
+
+    def _update_path(self, path, is_article):
+        records = dict(self._records)
+        try:
+            st = os.stat(path) if is_article else None
+        except OSError:
+            st = None
+        record = records.get(path)
+        if st is None:
+            if record is not None:
+                del records[path]
+                self._records = records
+                self._save([], [path])
+            return
+        if record is not None and record["mtime"] == st.st_mtime \
+                and record["size"] == st.st_size:
+            return
+        known_hash = record["header_hash"] if record is not None else None
+        record = self._update_record(
+            records, path, st, _read_article((path, known_hash)))
+        if record is not None:
+            self._records = records
+            self._save([record], [])
+
+    def rename(self, old_path, new_path, is_article=True):
+        """Move the record of old_path to new_path, then bring it up to
+        date like update_path().
+
+        A renamed file keeps its mtime and size, so its record is carried
+        over without reading the file again.
+        """
+        with self._lock:
+            if self._records is None:
+                return
+            records = dict(self._records)
+            record = records.pop(old_path, None)
+            if record is not None:
+                records[new_path] = dict(record, path=new_path)
+                self._records = records
+                self._save([records[new_path]], [old_path])
+            self._update_path(new_path, is_article)
+
+
+def header_hash(header):
+    """Return a hex digest of metadata header lines."""
+    data = "\n".join(header).encode("utf-8", "surrogatepass")
+    if hasattr(hashlib, "blake2b"):
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+    return hashlib.sha1(data).hexdigest()  # Python < 3.6
+
+
+def _storable(path):
+    try:
+        path.encode("utf-8")
+    except UnicodeError:
+        return False
+    return True
+
+
+def _read_article(article):
+    """Read the header of an article given as a (path, known hash) pair.
+
+    Returns (hash, metadata), with metadata None when the hash is the
+    known one, or None when the article cannot be read.
+    """
+    path, known_hash = article
+    try:
+        header = read_article_header(path)
+    except (IOError, OSError, UnicodeError) as e:
+        print("Article index: cannot read %s: %s" % (path, e))
+        return None
+    digest = header_hash(header)
+    if digest == known_hash:
+        return digest, None
+    return digest, parse_article_header(header, is_rst(path))
+
+
+def _read_articles(articles):
+    return [_read_article(article) for article in articles]
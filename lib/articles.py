@@ -0,0 +1,447 @@
+"""Reading metadata of Pelican articles.
+
+Articles are listed by walking the blog root, or by git for a work
+tree, and only their metadata header is read.
+"""
+import fnmatch
+import os
+import re
+import subprocess
+import sys
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None  # Python < 3.5, see _walk_listdir()
+
+ARTICLE_EXTENSIONS = ("md", "markdown", "mkd", "rst")
+
+# Directories that never contain articles; see find_articles().
+DEFAULT_EXCLUDE_GLOBS = (".git", ".hg", ".svn", "node_modules",
+                         "__pycache__", ".sass-cache", "output")
+
+# Metadata fields kept for every article.
+METADATA_FIELDS = ("title", "slug", "date", "tags", "category", "author",
+                   "lang", "summary", "status")
+
+# Fields holding a comma separated list of values.
+LIST_FIELDS = ("tags",)
+
+# Articles are only read up to the end of their metadata, and never more
+# than this many bytes.
+HEADER_MAX_BYTES = 32 * 1024
+
+# Seconds to wait for `git ls-files` before walking the directory instead.
+GIT_TIMEOUT = 10
+
+markdown_field_pattern = re.compile(r"^([A-Za-z][\w-]*):(.*)$")
+rst_field_pattern = re.compile(r"^:([\w-]+):(.*)$")
+rst_underline_pattern = re.compile(r"^([=\-`:'\"~^_*+#<>.])\1+$")
+
+class ArticleMatcher(object):
+    """Decides which files are articles and which paths are excluded.
+
+    Exclude globs without a slash are matched against the name of every
+    file and directory, globs with a slash against the path relative to
+    the root, using "/" as separator.
+    """
+
+    def __init__(self, extensions=ARTICLE_EXTENSIONS,
+                 exclude_globs=DEFAULT_EXCLUDE_GLOBS):
+        self.extensions = tuple(extensions)
+        self.article_pattern = re.compile(
+            r".*\.(%s)$" % "|".join(re.escape(ext) for ext in extensions))
+        name_globs = [g for g in exclude_globs if "/" not in g]
+        path_globs = [g.strip("/") for g in exclude_globs if "/" in g]
+        self.name_pattern = self._compile(name_globs)
+        self.path_pattern = self._compile(path_globs)
+
+    def _compile(self, globs):
+        if not globs:
+            return None
+        return re.compile("|".join(fnmatch.translate(g) for g in globs))
+
+    def is_excluded(self, name, relpath):
+        if self.name_pattern is not None and self.name_pattern.match(name):
+            return True
+        if self.path_pattern is not None and self.path_pattern.match(relpath):
+            return True
+        return False
+
+    def is_article(self, name, relpath):
+        return bool(self.article_pattern.match(name)) and \
+            not self.is_excluded(name, relpath)
+
+    def is_excluded_dir(self, reldir):
+        """Whether the directory reldir or one of its parents is excluded."""
+        if not reldir:
+            return False
+        parts = reldir.split("/")
+        for i, part in enumerate(parts):
+            if self.is_excluded(part, "/".join(parts[:i + 1])):
+                return True
+        return False
+
+    def is_article_path(self, relpath):
+        """Like is_article(), also checking every parent directory."""
+        reldir, _, name = relpath.rpartition("/")
+        return not self.is_excluded_dir(reldir) and \
+            self.is_article(name, relpath)
+
+
+def find_articles(root, matcher=None, max_file_size=None, use_git=False):
+    """Return the paths of the articles under root, and scan statistics.
+
+    Excluded directories are pruned before they are descended into.
+    Articles larger than max_file_size bytes are skipped. The statistics
+    count the directory entries visited, the ones skipped (not articles,
+    excluded or too large) and the directories pruned, and name the
+    backend that listed the files.
+
+    With use_git, the files are listed by git when root is inside a git
+    work tree: tracked files plus untracked ones that are not ignored, so
+    .gitignore applies on top of the matcher. The directory is walked when
+    git is not installed, fails, root is not in a work tree or is ignored
+    by it (e.g. a home directory repository ignoring "*"), or git lists no
+    article at all. See _git_ls_files() for the files git lists that may
+    not exist.
+    """
+    if matcher is None:
+        matcher = ArticleMatcher()
+    stats = {"visited": 0, "skipped": 0, "pruned": 0, "articles": 0,
+             "backend": "walk"}
+    if scandir is None:
+        walk = _walk_listdir
+    else:
+        walk = _walk_scandir
+    if use_git:
+        relpaths = _git_ls_files(root, matcher.extensions)
+        if relpaths and not _git_ignores_root(root):
+            stats["backend"] = "git"
+            walk = _walk_git(relpaths)
+    need_size = max_file_size is not None
+    article_paths = []
+    for path, size in walk(root, "", matcher, stats, need_size):
+        if need_size and size > max_file_size:
+            stats["skipped"] += 1
+            continue
+        article_paths.append(path)
+    stats["articles"] = len(article_paths)
+    return article_paths, stats
+
+
+def _walk_scandir(root, relroot, matcher, stats, need_size):
+    try:
+        entries = list(scandir(root))
+    except OSError:
+        return
+    subdirs = []
+    for entry in entries:
+        stats["visited"] += 1
+        relpath = relroot + entry.name
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if matcher.is_excluded(entry.name, relpath):
+                    stats["pruned"] += 1
+                else:
+                    subdirs.append((entry.path, relpath + "/"))
+                continue
+            if entry.is_file() and matcher.is_article(entry.name, relpath):
+                yield entry.path, entry.stat().st_size if need_size else None
+                continue
+        except OSError:
+            pass
+        stats["skipped"] += 1
+    for path, relpath in subdirs:
+        for result in _walk_scandir(path, relpath, matcher, stats,
+                                    need_size):
+            yield result
+
+
+def _walk_listdir(root, relroot, matcher, stats, need_size):
+    for dirpath, dirnames, filenames in os.walk(root):
+        reldir = os.path.relpath(dirpath, root).replace(os.sep, "/")
+        reldir = "" if reldir == "." else reldir + "/"
+        stats["visited"] += len(dirnames) + len(filenames)
+        for dirname in list(dirnames):
+            if matcher.is_excluded(dirname, reldir + dirname):
+                dirnames.remove(dirname)
+                stats["pruned"] += 1
+        for filename in filenames:
+            if not matcher.is_article(filename, reldir + filename):
+                stats["skipped"] += 1
+                continue
+            path = os.path.join(dirpath, filename)
+            size = None
+            if need_size:
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    stats["skipped"] += 1
+                    continue
+            yield path, size
+
+
+def filter_articles(root, paths, matcher=None, max_file_size=None,
+                    use_git=False):
+    """Return the paths under root, among paths, that find_articles() with
+    the same arguments would list, in order.
+
+    Checks files reported one at a time, e.g. by a file watcher, without
+    listing the whole blog again. With use_git, git is asked once for all
+    the paths which of them are ignored.
+    """
+    if matcher is None:
+        matcher = ArticleMatcher()
+    prefix = os.path.join(root, "")
+    candidates = []
+    for path in paths:
+        if not path.startswith(prefix):
+            continue
+        relpath = path[len(prefix):].replace(os.sep, "/")
+        if not matcher.is_article_path(relpath):
+            continue
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        if max_file_size is not None and size > max_file_size:
+            continue
+        candidates.append((path, relpath))
+    if use_git and candidates:
+        ignored = _git_check_ignore(
+            root, [relpath for path, relpath in candidates])
+        if ignored:
+            candidates = [(path, relpath) for path, relpath in candidates
+                          if relpath not in ignored]
+    return [path for path, relpath in candidates]
+
+
+def _run_git(root, args, input=None):
+    """Run git in root and return its exit status and output, or None when
+    git is not installed or does not finish in time."""
+    startupinfo = None
+    if os.name == "nt":
+        # don't flash a console window
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    try:
+        process = subprocess.Popen(
+            ["git"] + args, cwd=root, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            startupinfo=startupinfo)
+    except OSError:
+        return None
+    try:
+        output = process.communicate(input, timeout=GIT_TIMEOUT)[0]
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        return None
+    return process.returncode, output
+
+
+def _split_git_paths(output):
+    relpaths = output.decode(
+        sys.getfilesystemencoding(), "surrogateescape").split("\0")
+    relpaths.pop()  # after the last terminator
+    return relpaths
+
+
+def _git_check_ignore(root, relpaths):
+    """Return the set of relpaths that git ignores, or None when git
+    cannot tell or ignores root itself, as find_articles() then walks
+    root. Tracked files are never ignored."""
+    data = "\0".join(["."] + relpaths) + "\0"
+    result = _run_git(
+        root, ["check-ignore", "-z", "--stdin"],
+        data.encode(sys.getfilesystemencoding(), "surrogateescape"))
+    if result is None or result[0] not in (0, 1):
+        return None  # 1: nothing ignored, 128: not a work tree
+    ignored = set(_split_git_paths(result[1]))
+    if "." in ignored:
+        return None
+    return ignored
+
+
+def _git_ignores_root(root):
+    result = _run_git(root, ["check-ignore", "-q", "."])
+    return result is not None and result[0] == 0
+
+
+def _git_ls_files(root, extensions):
+    """Return the paths of the files with one of extensions git knows
+    under root, relative to root with "/" as separator, or None when git
+    cannot list them.
+
+    Tracked files deleted from the work tree are still listed until the
+    deletion is staged: checking for them costs a stat() per article,
+    more than git takes to list them.
+    """
+    result = _run_git(
+        root, ["ls-files", "-z", "--cached", "--others",
+               "--exclude-standard", "--"] +
+        ["*.%s" % extension for extension in extensions])
+    if result is None or result[0] != 0:
+        return None  # git is not installed or root is not in a work tree
+    relpaths = _split_git_paths(result[1])
+    if len(set(relpaths)) < len(relpaths):
+        # unmerged files are listed once per stage
+        seen = set()
+        relpaths = [relpath for relpath in relpaths
+                    if not (relpath in seen or seen.add(relpath))]
+    return relpaths
+
+
+def _walk_git(relpaths):
+    def walk(root, relroot, matcher, stats, need_size):
+        stats["visited"] += len(relpaths)
+        excluded_dirs = {}
+        prefix = os.path.join(root, "")
+        for relpath in relpaths:
+            reldir, _, name = relpath.rpartition("/")
+            excluded = excluded_dirs.get(reldir)
+            if excluded is None:
+                excluded = matcher.is_excluded_dir(reldir)
+                excluded_dirs[reldir] = excluded
+            if excluded or matcher.is_excluded(name, relpath):
+                stats["skipped"] += 1
+                continue
+            path = prefix + (relpath if os.sep == "/" else
+                             relpath.replace("/", os.sep))
+            size = None
+            if need_size:
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    stats["skipped"] += 1
+                    continue
+            yield path, size
+    return walk
+
+
+def split_list_field(value):
+    return [x.strip() for x in value.split(",") if x.strip()]
+
+
+def _header_lines(f, max_bytes):
+    read = 0
+    encoding = 'utf-8-sig'
+    for raw in f:
+        read += len(raw)
+        if read > max_bytes:
+            return
+        yield raw.decode(encoding, 'replace').rstrip('\r\n')
+        encoding = 'utf-8'
+
+
+def _read_markdown_header(lines, header):
+    # "Key: value" lines up to the first blank line, optionally fenced by
+    # "---" lines
+    in_fence = False
+    for line in lines:
+        stripped = line.strip()
+        if not header and not in_fence:
+            if not stripped:
+                continue
+            if stripped == '---':
+                in_fence = True
+                continue
+            if not markdown_field_pattern.match(line):
+                return
+        if in_fence:
+            if stripped in ('---', '...'):
+                return
+        elif not stripped:
+            return
+        header.append(line)
+
+
+def _read_rst_header(lines, header):
+    # the document title, then the docinfo field list; returns the title
+    title = None
+    pending = None
+    for line in lines:
+        stripped = line.strip()
+        if rst_field_pattern.match(line):
+            if pending is not None:
+                break  # a field list after a paragraph is not docinfo
+            header.append(line)
+            continue
+        if header:
+            if stripped and line[0] in ' \t':
+                header.append(line)  # continuation of the previous field
+                continue
+            break
+        if not stripped:
+            continue
+        if rst_underline_pattern.match(stripped):
+            if pending is not None:
+                title = title or pending
+                pending = None
+            continue
+        if pending is not None:
+            break  # body text, there is no docinfo
+        pending = stripped
+    return title
+
+
+def read_article_header(article_path, max_bytes=HEADER_MAX_BYTES):
+    """Return the metadata header lines of an article.
+
+    Only the Markdown metadata block or the reStructuredText title and
+    docinfo field list is read, and never more than max_bytes bytes. The
+    title of a reStructuredText document is returned as a ":title:" field.
+    """
+    header = []
+    with open(article_path, 'rb') as f:
+        lines = _header_lines(f, max_bytes)
+        if is_rst(article_path):
+            title = _read_rst_header(lines, header)
+            if title and not any(
+                    line.lower().startswith(':title:') for line in header):
+                header.insert(0, ':title: %s' % title)
+        else:
+            _read_markdown_header(lines, header)
+    return header
+
+
+def is_rst(article_path):
+    return article_path.lower().endswith('.rst')
+
+
+def parse_article_header(header, rst=False):
+    """Return a dict of the metadata fields found in header lines.
+
+    Missing fields are None, except list fields which are empty lists.
+    Indented lines continue the value of the previous field.
+    """
+    pattern = rst_field_pattern if rst else markdown_field_pattern
+    values = {}
+    key = None
+    for line in header:
+        m = pattern.match(line)
+        if m:
+            key = m.group(1).lower()
+            values.setdefault(key, []).append(m.group(2).strip())
+        elif key is not None and line[:1] in (' ', '\t'):
+            values[key][-1] = (values[key][-1] + ' ' + line.strip()).strip()
+
+    metadata = {}
+    for field in METADATA_FIELDS:
+        found = values.get(field, [])
+        if field in LIST_FIELDS:
+            metadata[field] = [
+                item for value in found for item in split_list_field(value)]
+        else:
+            metadata[field] = found[0] if found else None
+    return metadata
+
+
+def read_article_metadata(article_path):
+    """Return a dict of the metadata fields of an article.
+
+    The header is read and parsed once for all fields.
+    """
+    return parse_article_header(
+        read_article_header(article_path), is_rst(article_path))
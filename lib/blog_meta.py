@@ -0,0 +1,494 @@
+"""Fetching and caching the metadata a blog publishes at its metadata_url."""
+import collections
+import gzip
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import http.client as httplib
+from urllib.parse import urljoin, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+# Seconds to wait for the connection, and for the whole response.
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+
+MAX_REDIRECTS = 5
+READ_SIZE = 64 * 1024
+
+
+class FetchError(Exception):
+    pass
+
+
+class HTTPClient(object):
+    """Minimal HTTP client with hard timeouts.
+
+    Connecting may take at most connect_timeout seconds. Once connected,
+    the response must arrive within read_timeout seconds in total,
+    redirects included, however slowly the server trickles it. Redirects
+    and the proxies of the environment are followed. gzip and deflate
+    compressed responses are asked for and decompressed as they arrive.
+
+    Connections are closed after every request, unless the caller passes
+    a dict to get() in which connections are kept open per host and
+    reused; close_connections() closes them.
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def _connection(self, url, connections):
+        # returns a connection for url, the target to put in the request
+        # line, and whether the connection was used before
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise FetchError("unsupported URL %s" % url)
+        https = parts.scheme == "https"
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        proxy = getproxies().get(parts.scheme)
+        if proxy and proxy_bypass(parts.hostname):
+            proxy = None
+        if proxy and not https:
+            target = url
+        key = (parts.scheme, parts.hostname, parts.port, proxy)
+        if connections is not None and key in connections:
+            return connections[key], target, True
+        if proxy:
+            proxy_parts = urlsplit(proxy)
+            host, port = proxy_parts.hostname, proxy_parts.port
+        else:
+            host, port = parts.hostname, parts.port
+        if https:
+            conn = httplib.HTTPSConnection(
+                host, port, timeout=self.connect_timeout)
+            if proxy:
+                conn.set_tunnel(parts.hostname, parts.port)
+        else:
+            conn = httplib.HTTPConnection(
+                host, port, timeout=self.connect_timeout)
+        if connections is not None:
+            connections[key] = conn
+        return conn, target, False
+
+    def get(self, url, headers=None, connections=None):
+        """GET url and return the status, the headers (with lower case
+        names) and the decompressed body of the response, and the body as
+        received when it was gzip compressed, else None.
+
+        Raises FetchError.
+        """
+        headers = dict(headers or {})
+        headers.setdefault("Accept-Encoding", "gzip, deflate")
+        deadline = _Deadline(self.read_timeout)
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                conn, target, reused = self._connection(url, connections)
+                try:
+                    try:
+                        status, response_headers, body, gzipped = \
+                            self._request(conn, target, headers, deadline)
+                    except (ConnectionError, httplib.BadStatusLine):
+                        if not reused or deadline.expired:
+                            raise
+                        # the server closed the connection while it was idle
+                        conn.close()
+                        status, response_headers, body, gzipped = \
+                            self._request(conn, target, headers, deadline)
+                except (socket.error, httplib.HTTPException,
+                        zlib.error) as e:
+                    conn.close()
+                    if deadline.expired:
+                        e = "timed out"
+                    raise FetchError("cannot fetch %s: %s" % (url, e))
+                finally:
+                    if connections is None:
+                        conn.close()
+                location = response_headers.get("location")
+                if status in (301, 302, 303, 307, 308) and location:
+                    url = urljoin(url, location)
+                    continue
+                return status, response_headers, body, gzipped
+            raise FetchError("too many redirects for %s" % url)
+        finally:
+            deadline.cancel()
+
+    def _request(self, conn, target, headers, deadline):
+        if conn.sock is None:
+            # new, or closed by the last response
+            conn.timeout = self.connect_timeout
+            if deadline.started:
+                conn.timeout = min(conn.timeout, deadline.remaining())
+            conn.connect()
+        sock = conn.sock
+        deadline.start(sock)
+        sock.settimeout(deadline.remaining())
+        conn.request("GET", target, headers=headers)
+        response = conn.getresponse()
+        response_headers = dict(
+            (name.lower(), value) for name, value in response.getheaders())
+        encoding = response_headers.get("content-encoding", "identity")
+        encoding = encoding.strip().lower()
+        if encoding in ("gzip", "x-gzip"):
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            decompressor = zlib.decompressobj()
+        elif encoding == "identity":
+            decompressor = None
+        else:
+            raise FetchError("unsupported content encoding %s" % encoding)
+        chunks = []
+        received = []  # kept for gzip only
+        while not response.isclosed():
+            sock.settimeout(deadline.remaining())
+            chunk = response.read(READ_SIZE)
+            if not chunk:
+                break
+            with self._lock:
+                self.bytes_received += len(chunk)
+            if decompressor is None:
+                chunks.append(chunk)
+                continue
+            if encoding == "deflate" and not chunks and \
+                    chunk[:1] != b"\x78":
+                # some servers send raw deflate data, without zlib header
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            if encoding != "deflate":
+                received.append(chunk)
+            chunks.append(decompressor.decompress(chunk))
+        if deadline.expired:
+            # the socket was shut down, which reads as the end of the body
+            raise socket.timeout("timed out")
+        gzipped = None
+        if decompressor is not None and chunks:
+            chunks.append(decompressor.flush())
+            if not decompressor.eof:
+                raise FetchError("truncated %s response" % encoding)
+            if encoding != "deflate":
+                gzipped = b"".join(received)
+        return response.status, response_headers, b"".join(chunks), gzipped
+
+
+class _Deadline(object):
+    """Shuts down the socket being read once seconds have passed since
+    start() was first called.
+
+    A socket timeout only bounds every single receive, and a read of the
+    response keeps receiving until it has all the bytes it asked for, so
+    a server sending a byte now and then would keep it going for good.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = None
+        self.expired = False
+        self._sock = None
+        self._lock = threading.Lock()
+        self._timer = None
+
+    @property
+    def started(self):
+        return self._timer is not None
+
+    def start(self, sock):
+        """Watch sock from now on, starting the clock on the first call."""
+        with self._lock:
+            self._sock = sock
+            if self._timer is None:
+                self.expires = time.time() + self.seconds
+                self._timer = threading.Timer(self.seconds, self._expire)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def remaining(self):
+        """Return the seconds left, raising socket.timeout when none are."""
+        remaining = self.expires - time.time()
+        if remaining <= 0 or self.expired:
+            raise socket.timeout("timed out")
+        return remaining
+
+    def _expire(self):
+        with self._lock:
+            self.expired = True
+            sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except (socket.error, OSError):
+                pass  # already closed
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+def close_connections(connections):
+    """Close the connections kept by HTTPClient.get()."""
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+
+def prepare_metadata(metadata):
+    """Sort the "cats" and "tags" lists of metadata, dropping duplicates
+    and empty values, and the "posts" dict by title, as they are shown in
+    the quick panel."""
+    if isinstance(metadata, dict):
+        for key in ("cats", "tags"):
+            if isinstance(metadata.get(key), list):
+                values = set(metadata[key])
+                values.discard("")
+                metadata[key] = sorted(values)
+        if isinstance(metadata.get("posts"), dict):
+            metadata["posts"] = collections.OrderedDict(
+                sorted(metadata["posts"].items()))
+    return metadata
+
+
+class MetadataStore(object):
+    """The metadata of blogs, cached gzip compressed in meta-<name>.json.gz
+    files.
+
+    get() serves the cached copy right away and has it refreshed in the
+    background once it is older than max_age seconds; only a blog without
+    a cached copy is fetched while the caller waits. Cache files are
+    replaced atomically, so a failed or interrupted download never leaves
+    a truncated file behind.
+
+    The ETag and Last-Modified headers of a download are kept in
+    meta-<name>.validators.json, and sent back when the metadata is
+    fetched again; a 304 Not Modified answer only renews the cached copy.
+
+    The parsed metadata of every blog is kept in memory as long as its
+    cache file keeps the same mtime and size, so it is only read and
+    parsed again after a download or when another process replaced it.
+    """
+
+    def __init__(self, cache_dir, max_age=300, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.client = HTTPClient(connect_timeout, read_timeout)
+        self.errors = {}
+        self.stats = {"full": 0, "not_modified": 0, "failed": 0,
+                      "memory_hits": 0, "disk_loads": 0}
+        self._parsed = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        # notified whenever a refresh ends
+        self._refreshed = threading.Condition(self._lock)
+
+    def cache_path(self, name):
+        return os.path.join(self.cache_dir, "meta-%s.json.gz" % name)
+
+    def legacy_cache_path(self, name):
+        # uncompressed copies written by earlier versions
+        return os.path.join(self.cache_dir, "meta-%s.json" % name)
+
+    def _cached_path(self, name):
+        for path in (self.cache_path(name), self.legacy_cache_path(name)):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def validators_path(self, name):
+        return os.path.join(self.cache_dir, "meta-%s.validators.json" % name)
+
+    def _load_validators(self, name):
+        try:
+            with open(self.validators_path(name), "rb") as f:
+                return json.loads(f.read().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def load(self, name):
+        """Return the cached metadata of a blog, see prepare_metadata(),
+        and the time it was fetched, or (None, None)."""
+        path = self._cached_path(name)
+        if path is None:
+            return None, None
+        try:
+            st = os.stat(path)
+            with self._lock:
+                parsed = self._parsed.get(name)
+                if parsed is not None and \
+                        parsed[0] == (path, st.st_mtime, st.st_size):
+                    self.stats["memory_hits"] += 1
+                    return parsed[1], st.st_mtime
+            with open(path, "rb") as f:
+                data = f.read()
+            if path.endswith(".gz"):
+                data = gzip.decompress(data)
+            metadata = prepare_metadata(json.loads(data.decode("utf-8")))
+        except (IOError, OSError, ValueError, zlib.error):
+            return None, None
+        with self._lock:
+            self.stats["disk_loads"] += 1
+        self._remember(name, path, metadata, st)
+        return metadata, st.st_mtime
+
+    def _remember(self, name, path, metadata, st=None):
+        if st is None:
+            st = os.stat(path)
+        with self._lock:
+            self._parsed[name] = ((path, st.st_mtime, st.st_size), metadata)
+
+    def fetch(self, name, url, conditional=True, connections=None):
+        """Download the metadata of a blog, cache and return it.
+
+        With conditional, the cached copy is kept when the server says it
+        has not changed. connections is passed on to HTTPClient.get().
+        Raises FetchError, leaving the cached copy alone.
+        """
+        request_headers = {}
+        if conditional and self._cached_path(name) is not None:
+            validators = self._load_validators(name)
+            if validators.get("etag"):
+                request_headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                request_headers["If-Modified-Since"] = \
+                    validators["last_modified"]
+        status, headers, body, gzipped = self.client.get(
+            url, request_headers, connections)
+        if status == 304 and request_headers:
+            metadata = self.load(name)[0]
+            if metadata is None:
+                # the cached copy went away in the meantime
+                return self.fetch(name, url, False, connections)
+            path = self._cached_path(name)
+            os.utime(path, None)
+            self._remember(name, path, metadata)
+            self._fetched(name, "not_modified")
+            return metadata
+        if status != 200:
+            raise FetchError("%s returned HTTP %d" % (url, status))
+        try:
+            metadata = prepare_metadata(json.loads(body.decode("utf-8")))
+        except ValueError as e:
+            raise FetchError("%s is not valid JSON: %s" % (url, e))
+        # a gzip response is stored as received
+        if gzipped is None:
+            gzipped = gzip.compress(body, 6)
+        # the validators are written last: should that fail, the older
+        # ones make the next request unconditional rather than wrong
+        self._write(self.cache_path(name), gzipped)
+        self._remember(name, self.cache_path(name), metadata)
+        if os.path.exists(self.legacy_cache_path(name)):
+            os.remove(self.legacy_cache_path(name))
+        validators = {"etag": headers.get("etag"),
+                      "last_modified": headers.get("last-modified")}
+        if any(validators.values()):
+            self._write(self.validators_path(name),
+                        json.dumps(validators).encode("utf-8"))
+        elif os.path.exists(self.validators_path(name)):
+            os.remove(self.validators_path(name))
+        self._fetched(name, "full")
+        return metadata
+
+    def _fetched(self, name, kind):
+        with self._lock:
+            self.errors.pop(name, None)
+            self.stats[kind] += 1
+
+    def _write(self, path, data):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.cache_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def refresh(self, name, url, connections=None):
+        """fetch() a blog's metadata, remembering the error if it fails."""
+        try:
+            self.fetch(name, url, connections=connections)
+        except (FetchError, IOError, OSError) as e:
+            with self._lock:
+                self.errors[name] = e
+                self.stats["failed"] += 1
+            print("Blog metadata %s: %s" % (name, e))
+        finally:
+            with self._lock:
+                self._refreshing.discard(name)
+                self._refreshed.notify_all()
+
+    def get(self, name, url, revalidate):
+        """Return the metadata of a blog and whether it is stale.
+
+        A stale copy is handed out as is, and revalidate is called with a
+        function refreshing it, to be run in the background; at most one
+        refresh per blog is pending. Without a cached copy, the metadata is
+        fetched, or awaited from the refresh already in progress, e.g. a
+        prefetch(); it is None when it cannot be fetched.
+        """
+        metadata, fetched = self.load(name)
+        if metadata is None:
+            with self._lock:
+                in_progress = name in self._refreshing
+                while name in self._refreshing:
+                    self._refreshed.wait()
+                if not in_progress:
+                    self._refreshing.add(name)
+            if not in_progress:
+                self.refresh(name, url)
+            return self.load(name)[0], False
+        stale = time.time() - fetched > self.max_age
+        with self._lock:
+            stale = stale or name in self.errors
+            start = stale and name not in self._refreshing
+            if start:
+                self._refreshing.add(name)
+        if start:
+            revalidate(lambda: self.refresh(name, url))
+        return metadata, stale
+
+    def prefetch(self, blogs, workers=4):
+        """Fetch the metadata of blogs, a dict of names to metadata_url,
+        that has no cached copy or a stale one.
+
+        Blogs on different hosts are fetched concurrently by up to workers
+        threads, the blogs on one host one after the other over a single
+        connection. Returns the number of blogs fetched.
+        """
+        by_host = {}
+        now = time.time()
+        for name, url in sorted(blogs.items()):
+            metadata, fetched = self.load(name)
+            if metadata is not None and now - fetched <= self.max_age:
+                continue
+            with self._lock:
+                if name in self._refreshing:
+                    continue
+                self._refreshing.add(name)
+            host = urlsplit(url).netloc.lower()
+            by_host.setdefault(host, []).append((name, url))
+        if not by_host:
+            return 0
+        workers = max(1, min(workers, len(by_host)))
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(self._prefetch_host, by_host.values()))
+        return sum(len(host_blogs) for host_blogs in by_host.values())
+
+    def _prefetch_host(self, blogs):
+        connections = {}
+        try:
+            for name, url in blogs:
+                self.refresh(name, url, connections)
+        finally:
+            close_connections(connections)
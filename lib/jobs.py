@@ -0,0 +1,146 @@
+"""Coalescing and cancellation of background jobs."""
+import threading
+
+
+class Cancelled(Exception):
+    """Raised by Job.check() and JobManager.run() for cancelled jobs."""
+
+
+class Ticket(object):
+    """One request for results, e.g. one invocation of a command.
+
+    A ticket is superseded as soon as a newer ticket is taken for the
+    same group; whoever holds it should then drop its results.
+    """
+
+    def __init__(self, group):
+        self.group = group
+        self.superseded = False
+        self.key = None  # of the job it waits for, once it runs one
+
+
+class Job(object):
+    """A job running for a key, whose result is shared by every request
+    for the same key while it runs."""
+
+    def __init__(self, key):
+        self.key = key
+        self.tickets = []
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        """Raise Cancelled if the job was cancelled; called by the job
+        between its steps."""
+        if self._cancelled.is_set():
+            raise Cancelled(self.key)
+
+    def wait(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class JobManager(object):
+    """Runs at most one job per key at a time.
+
+    run() started while a job for the same key is running waits for that
+    job and takes over its result instead of doing the work again. A job
+    is cancelled once every ticket waiting for it has been superseded by
+    a request that runs another key or is released; a newer request for
+    the same key takes the job over instead. Jobs run without a ticket
+    are only cancelled by cancel_all().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._latest = {}
+        self.stats = {"started": 0, "coalesced": 0, "cancelled": 0}
+
+    def ticket(self, group):
+        """Return a ticket for a new request in group, superseding the
+        previous one.
+
+        The jobs of the previous request keep running until the new one
+        runs a job or is released, as it may take them over.
+        """
+        ticket = Ticket(group)
+        with self._lock:
+            previous = self._latest.get(group)
+            self._latest[group] = ticket
+            if previous is not None:
+                previous.superseded = True
+        return ticket
+
+    def release(self, ticket):
+        """Forget ticket once its request is done."""
+        with self._lock:
+            if self._latest.get(ticket.group) is ticket:
+                del self._latest[ticket.group]
+            self._cancel_abandoned()
+
+    def _cancel_abandoned(self):
+        # called with the lock held
+        for job in self._jobs.values():
+            if job.tickets and not job.cancelled and \
+                    all(self._abandons(t, job) for t in job.tickets):
+                job.cancel()
+                self.stats["cancelled"] += 1
+
+    def _abandons(self, ticket, job):
+        # whether job is of no use to ticket nor to the request that
+        # superseded it, which may still take the job over
+        if not ticket.superseded:
+            return False
+        latest = self._latest.get(ticket.group)
+        return latest is None or latest.key not in (None, job.key)
+
+    def run(self, key, function, ticket=None):
+        """Return function(job), or the result of the job already running
+        for key.
+
+        function runs in the calling thread and should call job.check()
+        between its steps. Raises Cancelled when the job is cancelled.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            owner = job is None or job.cancelled
+            if owner:
+                job = Job(key)
+                self._jobs[key] = job
+                self.stats["started"] += 1
+            else:
+                self.stats["coalesced"] += 1
+            if ticket is not None:
+                ticket.key = key
+                job.tickets.append(ticket)
+                self._cancel_abandoned()
+        if not owner:
+            return job.wait()
+        try:
+            job.result = function(job)
+        except BaseException as e:
+            job.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._jobs.get(key) is job:
+                    del self._jobs[key]
+            job._done.set()
+        return job.result
+
+    def cancel_all(self):
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancel()
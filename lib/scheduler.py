@@ -0,0 +1,139 @@
+"""A small pool of worker threads with priority lanes."""
+import collections
+import threading
+import time
+import traceback
+
+# Lanes, in order of priority.
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+
+class Scheduler(object):
+    """Runs submitted functions on up to workers threads.
+
+    Interactive jobs always run before queued background jobs, and
+    background jobs never take the last worker, so a command started by
+    the user does not wait for indexing to finish. Exceptions are printed
+    with their traceback, and the time jobs spend queued and running is
+    kept per job name.
+    """
+
+    def __init__(self, workers=3, name="Scheduler"):
+        self.name = name
+        self.workers = max(1, workers)
+        self._queues = {INTERACTIVE: collections.deque(),
+                        BACKGROUND: collections.deque()}
+        self._condition = threading.Condition()
+        self._threads = []
+        self._idle = 0
+        self._running_background = 0
+        self._shutdown = False
+        self._stats = {}
+
+    def configure(self, workers):
+        """Change the number of worker threads; only takes effect before
+        the first job is submitted."""
+        with self._condition:
+            if not self._threads:
+                self.workers = max(1, workers)
+
+    def submit(self, function, name=None, lane=INTERACTIVE):
+        """Queue function() to run on a worker thread.
+
+        Returns False when the scheduler has been shut down.
+        """
+        if name is None:
+            name = getattr(function, "__name__", repr(function))
+        with self._condition:
+            if self._shutdown:
+                return False
+            self._queues[lane].append((function, name, time.time()))
+            queued = sum(len(q) for q in self._queues.values())
+            if self._idle < queued and len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work,
+                    name="%s-%d" % (self.name, len(self._threads) + 1))
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+        return True
+
+    def _next(self):
+        # called with the condition held; None means shut down
+        interactive = self._queues[INTERACTIVE]
+        background = self._queues[BACKGROUND]
+        while True:
+            if self._shutdown:
+                return None
+            if interactive:
+                return interactive.popleft() + (INTERACTIVE,)
+            if background and self._running_background < max(
+                    1, self.workers - 1):
+                self._running_background += 1
+                return background.popleft() + (BACKGROUND,)
+            self._idle += 1
+            self._condition.wait()
+            self._idle -= 1
+
+    def _work(self):
+        while True:
+            with self._condition:
+                job = self._next()
+            if job is None:
+                return
+            function, name, queued = job[:3]
+            started = time.time()
+            failed = False
+            try:
+                function()
+            except Exception:
+                failed = True
+                print("%s: job %s failed:\n%s" % (
+                    self.name, name, traceback.format_exc()))
+            finished = time.time()
+            with self._condition:
+                if job[3] == BACKGROUND:
+                    self._running_background -= 1
+                    self._condition.notify()
+                self._record(name, started - queued, finished - started,
+                             failed)
+
+    def _record(self, name, wait, run, failed):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = {
+                "runs": 0, "failures": 0, "wait_total": 0.0,
+                "run_total": 0.0, "run_max": 0.0}
+        stats["runs"] += 1
+        stats["failures"] += failed
+        stats["wait_total"] += wait
+        stats["run_total"] += run
+        stats["run_max"] = max(stats["run_max"], run)
+
+    def stats(self):
+        """Return the number of queued jobs, and the runs, failures and
+        timings in seconds of the jobs by name."""
+        with self._condition:
+            return {
+                "queued": sum(len(q) for q in self._queues.values()),
+                "jobs": dict((name, dict(stats))
+                             for name, stats in self._stats.items()),
+            }
+
+    def shutdown(self, timeout=1.0):
+        """Drop queued jobs and wait up to timeout seconds for running ones.
+
+        Running jobs are not interrupted; the worker threads exit when
+        they are done.
+        """
+        with self._condition:
+            self._shutdown = True
+            for queue in self._queues.values():
+                queue.clear()
+            self._condition.notify_all()
+            threads = list(self._threads)
+        deadline = time.time() + timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
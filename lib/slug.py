@@ -0,0 +1,118 @@
+"""Slug generation for Pelican articles."""
+import collections
+import functools
+import itertools
+import re
+import unicodedata
+
+from .unidecode import unidecode
+
+strip_pattern = re.compile(r'[^\w\s-]')
+hyphenate_pattern = re.compile(r'[-\s]+')
+
+# Batches smaller than this are not worth starting worker processes for.
+PROCESS_POOL_THRESHOLD = 5000
+
+
+class SlugEngine(object):
+    """Turns titles into slugs, memoizing the most recent ones.
+
+    With slug generation on title change, a slug is computed on every
+    keystroke in the title line; retyping or undoing gives titles that were
+    already seen, which are then answered from the memo.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.slugify = functools.lru_cache(maxsize)(self.slugify_uncached)
+
+    def slugify_uncached(self, value):
+        """
+        Normalizes string, converts to lowercase, removes non-alpha
+        characters, and converts spaces to hyphens.
+
+        Took from django sources.
+        """
+        # value must be unicode per se
+        value = unicodedata.normalize('NFKD', value).lower()
+        value = unidecode(value)
+        value = strip_pattern.sub('', value).strip()
+        value = hyphenate_pattern.sub('-', value)
+        return value
+
+    def sections(self, value):
+        """Return the unidecode sections slugify(value) will look up."""
+        value = unicodedata.normalize('NFKD', value).lower()
+        return set(ord(char) >> 8 for char in set(value)
+                   if 0x80 <= ord(char) <= 0xeffff)
+
+    def stats(self):
+        info = self.slugify.cache_info()
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "maxsize": info.maxsize,
+        }
+
+    def clear(self):
+        self.slugify.cache_clear()
+
+    def slugify_many(self, values, processes=0,
+                     threshold=PROCESS_POOL_THRESHOLD, chunksize=500):
+        """Yield the slug of every value, in order.
+
+        Runs in the calling thread unless processes is given, in which case
+        batches of at least threshold values are spread over a pool of that
+        many processes. Values are consumed and slugs yielded as they go,
+        with a bounded number of chunks in flight.
+
+        Worker processes are started from sys.executable, so the pool is
+        only usable from a regular Python interpreter, not from Sublime
+        Text's plugin host.
+        """
+        values = iter(values)
+        if not processes:
+            for value in values:
+                yield self.slugify(value)
+            return
+
+        head = list(itertools.islice(values, threshold))
+        if len(head) < threshold:
+            for value in itertools.chain(head, values):
+                yield self.slugify(value)
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunks = _chunked(itertools.chain(head, values), chunksize)
+        with ProcessPoolExecutor(processes) as executor:
+            window = 2 * processes
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(
+                    executor.submit(_slugify_chunk, chunk))
+                if len(pending) >= window:
+                    for slug in pending.popleft().result():
+                        yield slug
+            while pending:
+                for slug in pending.popleft().result():
+                    yield slug
+
+
+def _chunked(iterable, size):
+    while True:
+        chunk = list(itertools.islice(iterable, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+_worker_engine = None
+
+
+def _slugify_chunk(values):
+    """Slugify a list of values in a worker process."""
+    global _worker_engine
+    if _worker_engine is None:
+        _worker_engine = SlugEngine()
+    return [_worker_engine.slugify(value) for value in values]
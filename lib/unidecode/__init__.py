@@ -14,16 +14,321 @@ In Python 3, a standard string object will be returned. If you need bytes, use:
 >>> unidecode("Κνωσός").encode("ascii")
 b'Knosos'
 """
+import mmap
+import os
+from array import array
+import struct
+import sys
+import threading
+import time
 import warnings
 from sys import version_info
 
-Cache = {}
+# "translate" transliterates a whole string with one str.translate() call,
+# "loop" looks every character up in Python.
+ENGINE = "translate"
 
-def unidecode(string, is_st2):
+# In-memory representation of loaded sections: "mapped" reads them from
+# the memory-mapped table.bin and decodes each one into a tuple of strings
+# once, "tuple" keeps the data tuple of the x???.py module, "compact" one
+# string per section plus an array of offsets, read from table.bin.
+# table.bin falls back to the x???.py modules when it cannot be mapped.
+REPRESENTATION = "mapped"
+
+# Sections of the large scripts: CJK Unified Ideographs and Extension A,
+# Yi, Hangul Syllables and CJK Compatibility Ideographs. These hold most of
+# the memory and are rarely needed by all titles of a blog at once.
+LARGE_SECTIONS = frozenset(
+    list(range(0x34, 0xa5)) + list(range(0xac, 0xd8)) +
+    list(range(0xf9, 0xfb)))
+
+# Layout of table.bin, see build.py.
+_TABLE_MAGIC = b'UDTB'
+_TABLE_VERSION = 1
+_TABLE_HEADER = struct.Struct('<4sHH')
+_TABLE_PATH = os.path.join(os.path.dirname(__file__), 'table.bin')
+
+
+class MappedSection(object):
+    """One 256 code point section backed by the memory-mapped table."""
+
+    __slots__ = ('_table', '_count', '_offsets', '_pool')
+
+    def __init__(self, table, block):
+        self._table = table
+        self._count = struct.unpack_from('<H', table, block)[0]
+        self._offsets = block + 2
+        self._pool = self._offsets + 2 * (self._count + 1)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, position):
+        start, end = struct.unpack_from(
+            '<HH', self._table, self._offsets + 2 * position)
+        return self._table[self._pool + start:self._pool + end].decode('ascii')
+
+    def strings(self):
+        """Return all strings of the section, decoding the pool only once."""
+        offsets = struct.unpack_from(
+            '<%dH' % (self._count + 1), self._table, self._offsets)
+        pool = self._table[self._pool:self._pool + offsets[-1]].decode('ascii')
+        return tuple(pool[offsets[i]:offsets[i + 1]]
+                     for i in range(self._count))
+
+
+class CompactSection(object):
+    """One section as a single string and an array of 16-bit offsets."""
+
+    __slots__ = ('_text', '_offsets')
+
+    def __init__(self, strings):
+        self._text = ''.join(strings)
+        self._offsets = offsets = array('H', [0])
+        for s in strings:
+            offsets.append(offsets[-1] + len(s))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, position):
+        offsets = self._offsets
+        return self._text[offsets[position]:offsets[position + 1]]
+
+    def strings(self):
+        offsets = self._offsets
+        return tuple(self._text[offsets[i]:offsets[i + 1]]
+                     for i in range(len(offsets) - 1))
+
+
+def _open_table():
+    """Map table.bin, or return None if it is missing or not readable.
+
+    The table cannot be mapped when the package is installed as a zipped
+    .sublime-package; the x???.py modules are used in that case.
+    """
+    try:
+        with open(_TABLE_PATH, 'rb') as f:
+            table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        magic, version, count = _TABLE_HEADER.unpack_from(table, 0)
+        struct.unpack_from('<%dI' % count, table, _TABLE_HEADER.size)
+    except struct.error:
+        magic = None  # truncated
+    if magic != _TABLE_MAGIC or version != _TABLE_VERSION:
+        table.close()
+        return None
+    return table, count
+
+
+_Table = _open_table()
+
+
+def close_table():
+    """Unmap table.bin, e.g. when the plugin is unloaded, so that it is
+    not kept locked on Windows. Sections loaded later are read from the
+    x???.py modules."""
+    global _Table
+    if _Table is not None:
+        table, _Table = _Table[0], None
+        table.close()
+
+
+def _load_mapped_section(section, mapped):
+    table, count = mapped
+    if section >= count:
+        return None
+    block = struct.unpack_from(
+        '<I', table, _TABLE_HEADER.size + 4 * section)[0]
+    if not block:
+        return None
+    return MappedSection(table, block)
+
+
+def _load_section(section):
+    """Return the transliteration table of a section, or None."""
+    mapped = _Table
+    if mapped is not None and REPRESENTATION != "tuple":
+        table = _load_mapped_section(section, mapped)
+        if table is None:
+            return None
+        # decoded once here rather than on every lookup
+        table = table.strings()
+    else:
+        try:
+            mod = __import__('%s.x%03x' % (__name__, section),
+                             globals(), locals(), ['data'])
+        except ImportError:
+            return None
+        table = mod.data
+
+    if REPRESENTATION == "compact":
+        return CompactSection(table)
+    return table
+
+
+def _sizeof_table(table):
+    if isinstance(table, CompactSection):
+        return sys.getsizeof(table) + sys.getsizeof(table._text) + \
+            sys.getsizeof(table._offsets)
+    if not isinstance(table, tuple):
+        return sys.getsizeof(table)
+    return sys.getsizeof(table) + sum(sys.getsizeof(s) for s in table)
+
+
+class _CacheEntry(object):
+
+    __slots__ = ('table', 'size', 'last_used')
+
+    def __init__(self, table):
+        self.table = table
+        self.size = _sizeof_table(table) if table is not None else 0
+        self.last_used = time.time()
+
+
+class SectionCache(object):
+    """Bounded cache of loaded transliteration sections.
+
+    Lookups read a plain dict and take no lock; loading and eviction are
+    serialized by a lock. Once more than max_sections sections or max_bytes
+    bytes (None for no limit) are resident, the least recently used
+    sections are evicted; pinned sections never are.
+
+    Hit counts are updated without the lock and may be slightly low when
+    several threads transliterate at once.
+    """
+
+    def __init__(self, max_sections=128, max_bytes=None):
+        self.max_sections = max_sections
+        self.max_bytes = max_bytes
+        self._entries = {}
+        self._pinned = frozenset()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.bytes_resident = 0
+
+    def __contains__(self, section):
+        return section in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _entry(self, section):
+        entry = self._entries.get(section)
+        if entry is None:
+            with self._lock:
+                entry = self._entries.get(section)
+                if entry is None:
+                    self.misses += 1
+                    entry = self._load(section)
+                else:
+                    self.hits += 1
+        else:
+            self.hits += 1
+        entry.last_used = time.time()
+        return entry
+
+    def _load(self, section):
+        entry = _CacheEntry(_load_section(section))
+        self.loads += 1
+        self._entries[section] = entry
+        self.bytes_resident += entry.size
+        self._evict(keep=section)
+        return entry
+
+    def _over_limit(self):
+        if self.max_sections is not None and \
+                len(self._entries) > self.max_sections:
+            return True
+        if self.max_bytes is not None and \
+                self.bytes_resident > self.max_bytes:
+            return True
+        return False
+
+    def _remove(self, section):
+        entry = self._entries.pop(section)
+        self.bytes_resident -= entry.size
+        self.evictions += 1
+
+    def _evict(self, keep=None):
+        while self._over_limit():
+            candidates = [
+                (entry.last_used, section)
+                for section, entry in self._entries.items()
+                if section != keep and section not in self._pinned]
+            if not candidates:
+                break
+            self._remove(min(candidates)[1])
+
+    def get_table(self, section):
+        """Return the table of a section, None if there is none."""
+        return self._entry(section).table
+
+    def preload(self, sections):
+        """Load the given sections ahead of use."""
+        for section in sections:
+            self.get_table(section)
+
+    def pin(self, sections):
+        """Keep the given sections resident, exempt from eviction."""
+        with self._lock:
+            self._pinned = frozenset(sections)
+        self.preload(self._pinned)
+
+    def configure(self, max_sections=None, max_bytes=None):
+        with self._lock:
+            self.max_sections = max_sections
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def release_idle(self, idle_seconds, sections=None):
+        """Drop sections unused for idle_seconds, only those in sections
+        unless it is None.
+
+        Returns the number of released sections.
+        """
+        deadline = time.time() - idle_seconds
+        with self._lock:
+            idle = [section for section, entry in self._entries.items()
+                    if entry.last_used < deadline
+                    and (sections is None or section in sections)
+                    and section not in self._pinned]
+            for section in idle:
+                self._remove(section)
+        return len(idle)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes_resident = 0
+
+    def stats(self):
+        return {
+            "sections": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "bytes_resident": self.bytes_resident,
+        }
+
+
+Cache = SectionCache()
+
+
+def unidecode(string, engine=None):
     """Transliterate an Unicode object into an ASCII string
 
     >>> unidecode(u"\u5317\u4EB0")
     "Bei Jing "
+
+    engine selects the implementation, "translate" (the default, see
+    ENGINE) or "loop"; both return the same result.
     """
 
     if version_info[0] < 3 and not isinstance(string, unicode):
@@ -32,6 +337,49 @@ def unidecode(string, is_st2):
                         "unexpected results." % (type(string),),
 			RuntimeWarning, 2)
 
+    if (engine or ENGINE) == "loop":
+        return _unidecode_loop(string)
+    return _unidecode_translate(string)
+
+
+class _Translation(dict):
+    """str.translate() mapping filled in as translate() meets characters,
+    so that each distinct character is looked up once per string."""
+
+    __slots__ = ()
+
+    def __missing__(self, codepoint):
+        if codepoint < 0x80:
+            value = codepoint
+        elif codepoint > 0xeffff:
+            value = None
+        else:
+            if 0xd800 <= codepoint <= 0xdfff:
+                warnings.warn(  "Surrogate character %r will be ignored. "
+                                "You might be using a narrow Python build."
+                                % (chr(codepoint),), RuntimeWarning, 4)
+            table = Cache.get_table(codepoint >> 8)
+            position = codepoint % 256
+            if table and len(table) > position:
+                value = table[position] or None
+            else:
+                value = None
+        self[codepoint] = value
+        return value
+
+
+def _unidecode_translate(string):
+    try:
+        string.encode('ascii')
+    except UnicodeError:
+        pass
+    else:
+        return string
+
+    return string.translate(_Translation())
+
+
+def _unidecode_loop(string):
     retval = []
 
     for char in string:
@@ -47,25 +395,12 @@ def unidecode(string, is_st2):
         if 0xd800 <= codepoint <= 0xdfff:
             warnings.warn(  "Surrogate character %r will be ignored. "
                             "You might be using a narrow Python build." % (char,),
-                            RuntimeWarning, 2)
+                            RuntimeWarning, 3)
 
         section = codepoint >> 8   # Chop off the last two hex digits
         position = codepoint % 256 # Last two hex digits
 
-        try:
-            table = Cache[section]
-        except KeyError:
-            try:
-                if is_st2:
-                    import_prefix = 'lib.'
-                else:
-                    import_prefix = 'Pelican.lib.'
-                mod = __import__('%sunidecode.x%03x' % (import_prefix, section), globals(), locals(), ['data'])
-            except ImportError:
-                Cache[section] = None
-                continue   # No match: ignore this character and carry on.
-
-            Cache[section] = table = mod.data
+        table = Cache.get_table(section)
 
         if table and len(table) > position:
             retval.append( table[position] )
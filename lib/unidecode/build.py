@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# vi:tabstop=4:expandtab:sw=4
+"""Compile the x???.py section modules into a single binary table.
+
+Usage:
+    python lib/unidecode/build.py
+
+The resulting ``table.bin`` is memory-mapped by ``unidecode()`` so that a
+lookup is a slice of a page-cached file instead of a module import. It has
+to be regenerated whenever one of the x???.py files changes.
+
+File layout (all integers little-endian):
+
+    header     4s magic, H version, H number of sections
+    directory  one I per section: offset of its block, 0 if absent
+    block      H count, (count + 1) H offsets into the pool, pool bytes
+
+The string of a code point is ``pool[offsets[pos]:offsets[pos + 1]]``.
+"""
+import glob
+import os
+import re
+import struct
+
+TABLE_MAGIC = b'UDTB'
+TABLE_VERSION = 1
+TABLE_FILENAME = 'table.bin'
+
+HEADER = struct.Struct('<4sHH')
+
+
+def load_sections(directory):
+    """Return {section: data} for every x???.py module in directory."""
+    sections = {}
+    for path in glob.glob(os.path.join(directory, 'x*.py')):
+        m = re.match(r'^x([0-9a-f]{3})\.py$', os.path.basename(path))
+        if not m:
+            continue
+        namespace = {}
+        with open(path, 'rb') as f:
+            exec(compile(f.read(), path, 'exec'), namespace)
+        sections[int(m.group(1), 16)] = namespace['data']
+    return sections
+
+
+def build_block(data):
+    pool = b''.join(s.encode('ascii') for s in data)
+    offsets = [0]
+    for s in data:
+        offsets.append(offsets[-1] + len(s))
+    if offsets[-1] > 0xffff:
+        raise ValueError('section pool does not fit 16-bit offsets')
+    return struct.pack('<%dH' % (len(offsets) + 1), len(data), *offsets) + pool
+
+
+def build_table(sections):
+    count = max(sections) + 1
+    blocks = []
+    directory = []
+    position = HEADER.size + 4 * count
+    for section in range(count):
+        if section not in sections:
+            directory.append(0)
+            continue
+        block = build_block(sections[section])
+        directory.append(position)
+        blocks.append(block)
+        position += len(block)
+    return b''.join(
+        [HEADER.pack(TABLE_MAGIC, TABLE_VERSION, count),
+         struct.pack('<%dI' % count, *directory)] + blocks)
+
+
+def main():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    table = build_table(load_sections(directory))
+    target = os.path.join(directory, TABLE_FILENAME)
+    with open(target + '.tmp', 'wb') as f:
+        f.write(table)
+    os.replace(target + '.tmp', target)
+    print('Wrote %s (%d bytes)' % (target, len(table)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""Watching a blog's content directory for changed articles.
+
+Uses inotify through ctypes on Linux and polls the article list
+elsewhere.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from .articles import ArticleMatcher, find_articles
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+class Watcher(threading.Thread):
+    """Base class of the watchers, calling on_change from its own thread.
+
+    on_change receives a set of paths that changed, were created or were
+    removed, coalesced over a short delay. A path may be a directory whose
+    whole content changed. on_change(None) means events were lost and
+    everything has to be checked again.
+    """
+
+    def __init__(self, root, on_change, matcher=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.root = root
+        self.on_change = on_change
+        self.matcher = matcher or ArticleMatcher()
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _notify(self, paths):
+        try:
+            self.on_change(paths)
+        except Exception as e:
+            print("Watcher %s: %s" % (self.root, e))
+
+
+class InotifyWatcher(Watcher):
+    """Watches every non-excluded directory under root with inotify.
+
+    The directories are added from the watcher's thread, so starting it
+    does not wait for the tree to be walked.
+    """
+
+    def __init__(self, root, on_change, matcher=None, delay=0.5,
+                 max_delay=2.0):
+        Watcher.__init__(self, root, on_change, matcher)
+        self.delay = delay
+        self.max_delay = max_delay
+        self._fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches = {}
+
+    def _add_watch(self, path):
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err != errno.ENOENT:
+                print("Watcher: cannot watch %s: %s" % (
+                    path, os.strerror(err)))
+            return
+        self._watches[wd] = path
+
+    def _add_tree(self, path, relpath):
+        self._add_watch(path)
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return
+        for name in names:
+            child = os.path.join(path, name)
+            child_relpath = relpath + name
+            if os.path.isdir(child) and not os.path.islink(child) and \
+                    not self.matcher.is_excluded(name, child_relpath):
+                self._add_tree(child, child_relpath + "/")
+
+    def _relpath(self, path):
+        relpath = os.path.relpath(path, self.root)
+        return relpath.replace(os.sep, "/")
+
+    def _read_events(self, pending):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return True
+            raise
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return False
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            name = os.path.basename(path)
+            if mask & IN_ISDIR:
+                if self.matcher.is_excluded(name, self._relpath(path)):
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(path, self._relpath(path) + "/")
+                pending.add(path)
+            elif self.matcher.is_article_path(self._relpath(path)):
+                pending.add(path)
+        return True
+
+    def run(self):
+        pending = set()
+        first_event = last_event = None
+        try:
+            self._add_tree(self.root, "")
+            while not self._stopped.is_set():
+                readable = select.select([self._fd], [], [], self.delay)[0]
+                now = time.time()
+                if readable:
+                    before = len(pending)
+                    if not self._read_events(pending):
+                        pending.clear()
+                        first_event = None
+                        self._notify(None)
+                        continue
+                    if len(pending) > before:
+                        last_event = now
+                        first_event = first_event or now
+                if pending and (now - last_event >= self.delay or
+                                now - first_event >= self.max_delay):
+                    changed, pending = pending, set()
+                    first_event = None
+                    self._notify(changed)
+        finally:
+            os.close(self._fd)
+
+
+class PollingWatcher(Watcher):
+    """Lists the articles under root every interval seconds and reports
+    the ones that appeared, disappeared or whose mtime or size changed.
+
+    list_articles(root) returns the paths of the articles, by default
+    find_articles() with matcher.
+    """
+
+    def __init__(self, root, on_change, matcher=None, interval=5.0,
+                 list_articles=None):
+        Watcher.__init__(self, root, on_change, matcher)
+        self.interval = interval
+        self.list_articles = list_articles or (
+            lambda root: find_articles(root, self.matcher)[0])
+        self._snapshot = None
+
+    def _scan(self):
+        snapshot = {}
+        for path in self.list_articles(self.root):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (st.st_mtime, st.st_size)
+        return snapshot
+
+    def run(self):
+        self._snapshot = self._scan()
+        while not self._stopped.wait(self.interval):
+            snapshot = self._scan()
+            changed = set(
+                path for path in set(snapshot) | set(self._snapshot)
+                if snapshot.get(path) != self._snapshot.get(path))
+            self._snapshot = snapshot
+            if changed:
+                self._notify(changed)
+
+
+def start_watcher(root, on_change, matcher=None, interval=5.0,
+                  list_articles=None):
+    """Start and return the best watcher available for root.
+
+    Uses inotify on Linux and polls every interval seconds elsewhere, see
+    PollingWatcher for list_articles.
+    """
+    watcher = None
+    if _libc is not None:
+        try:
+            watcher = InotifyWatcher(root, on_change, matcher)
+        except OSError as e:
+            print("Watcher: inotify unavailable, polling %s: %s" % (root, e))
+    if watcher is None:
+        watcher = PollingWatcher(root, on_change, matcher, interval,
+                                 list_articles)
+    watcher.start()
+    return watcher